@@ -12,6 +12,9 @@ from elasticsearch import Elasticsearch
 from redis import Redis
 import rq
 from config import Config
+from app.cache import TwoTierCache
+from app.language import LanguageDetector
+from app.passwords import PasswordHasher
 
 
 def get_locale():
@@ -43,6 +46,34 @@ def create_app(config_class=Config):
     app.redis = Redis.from_url(app.config['REDIS_URL'])
     app.task_queue = rq.Queue('microblog-tasks', connection=app.redis)
 
+    from app.queries import QueryStats
+    app.query_stats = QueryStats(app)
+    from app.search import backends
+    app.search = backends[app.config['SEARCH_BACKEND'] or (
+        'elasticsearch' if app.elasticsearch else 'database')](app)
+    from app.last_seen import LastSeenBuffer
+    app.last_seen = LastSeenBuffer(app,
+                                   app.config['LAST_SEEN_FLUSH_INTERVAL'])
+    app.translation_cache = TwoTierCache(
+        app.redis, 'translate', app.config['TRANSLATION_CACHE_SIZE'],
+        app.config['TRANSLATION_CACHE_TTL'])
+    app.passwords = PasswordHasher(
+        app.config['SECRET_KEY'], app.config['PASSWORD_HASH_METHOD'],
+        app.config['PASSWORD_HASH_WORKERS'],
+        app.config['PASSWORD_CHECK_TIMEOUT'],
+        app.config['PASSWORD_CACHE_SIZE'], app.config['PASSWORD_CACHE_TTL'])
+    app.token_cache = TwoTierCache(
+        app.redis, 'tokens', app.config['TOKEN_CACHE_SIZE'],
+        app.config['TOKEN_CACHE_TTL'],
+        local_ttl=app.config['TOKEN_CACHE_LOCAL_TTL'], invalidations=True)
+    app.language_detector = LanguageDetector(
+        TwoTierCache(app.redis, 'language', app.config['LANGUAGE_CACHE_SIZE'],
+                     app.config['LANGUAGE_CACHE_TTL']),
+        app.config['LANGUAGE_DETECTION_SEED'])
+    app.search_cache = TwoTierCache(
+        app.redis, 'search', app.config['SEARCH_CACHE_SIZE'],
+        app.config['SEARCH_CACHE_TTL'])
+
     from app.errors import bp as errors_bp
     app.register_blueprint(errors_bp)
 
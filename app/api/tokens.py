@@ -1,6 +1,8 @@
+import redis
 from app import db
 from app.api import bp
 from app.api.auth import basic_auth, token_auth
+from app.api.errors import error_response
 
 
 @bp.route('/tokens', methods=['POST'])
@@ -14,6 +16,9 @@ def get_token():
 @bp.route('/tokens', methods=['DELETE'])
 @token_auth.login_required
 def revoke_token():
-    token_auth.current_user().revoke_token()
+    try:
+        token_auth.current_user().revoke_token(token_auth.get_auth().token)
+    except redis.exceptions.RedisError:
+        return error_response(503)
     db.session.commit()
     return '', 204
@@ -18,8 +18,20 @@ def get_user(id):
 def get_users():
     page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 10, type=int), 100)
+    cursor = request.args.get('cursor')
     return User.to_collection_dict(sa.select(User), page, per_page,
-                                   'api.get_users')
+                                   'api.get_users', cursor=cursor)
+
+
+@bp.route('/users/autocomplete', methods=['GET'])
+@token_auth.login_required
+def autocomplete_users():
+    prefix = request.args.get('prefix', '')
+    if not prefix:
+        return bad_request('must include a prefix')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    return {'items': [{'id': id, 'username': username}
+                      for id, username in User.autocomplete(prefix, limit)]}
 
 
 @bp.route('/users/<int:id>/followers', methods=['GET'])
@@ -28,8 +40,9 @@ def get_followers(id):
     user = db.get_or_404(User, id)
     page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 10, type=int), 100)
+    cursor = request.args.get('cursor')
     return User.to_collection_dict(user.followers.select(), page, per_page,
-                                   'api.get_followers', id=id)
+                                   'api.get_followers', cursor=cursor, id=id)
 
 
 @bp.route('/users/<int:id>/following', methods=['GET'])
@@ -38,8 +51,9 @@ def get_following(id):
     user = db.get_or_404(User, id)
     page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 10, type=int), 100)
+    cursor = request.args.get('cursor')
     return User.to_collection_dict(user.following.select(), page, per_page,
-                                   'api.get_following', id=id)
+                                   'api.get_following', cursor=cursor, id=id)
 
 
 @bp.route('/users', methods=['POST'])
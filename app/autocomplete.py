@@ -0,0 +1,57 @@
+from flask import current_app
+
+KEY = 'autocomplete:users'
+
+
+# members sort by username, the id makes them unique across renames
+def _member(id, username):
+    return f'{username}\x00{id}'.encode('utf-8')
+
+
+def lookup(prefix, limit=10):
+    start = b'[' + prefix.encode('utf-8')
+    pipeline = current_app.redis.pipeline(transaction=False)
+    pipeline.exists(KEY)
+    pipeline.zrangebylex(KEY, start, start + b'\xff', start=0, num=limit)
+    exists, members = pipeline.execute()
+    if not exists:
+        return None
+    results = []
+    for member in members:
+        username, id = member.decode('utf-8').split('\x00')
+        results.append((int(id), username))
+    return results
+
+
+def update(changes):
+    if not current_app.redis.exists(KEY):
+        # not built yet, the users are added by the next rebuild
+        return
+    pipeline = current_app.redis.pipeline(transaction=False)
+    for id, old_username, new_username in changes:
+        if old_username is not None:
+            pipeline.zrem(KEY, _member(id, old_username))
+        if new_username is not None:
+            pipeline.zadd(KEY, {_member(id, new_username): 0})
+    pipeline.execute()
+
+
+def rebuild(users, batch_size=10000):
+    staging_key = KEY + ':rebuild'
+    current_app.redis.delete(staging_key)
+    count = 0
+    batch = {}
+    for id, username in users:
+        batch[_member(id, username)] = 0
+        if len(batch) == batch_size:
+            current_app.redis.zadd(staging_key, batch)
+            count += len(batch)
+            batch = {}
+    if batch:
+        current_app.redis.zadd(staging_key, batch)
+        count += len(batch)
+    if count:
+        current_app.redis.rename(staging_key, KEY)
+    else:
+        current_app.redis.delete(KEY)
+    return count
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+import json
+from threading import Lock, Thread
+from time import monotonic, sleep
+import redis
+
+
+# values must be JSON serializable, None is used to report a cache miss
+class TwoTierCache:
+    def __init__(self, redis_client, name, maxsize=1024, ttl=3600,
+                 stats_interval=60, local_ttl=None, invalidations=False):
+        self.redis = redis_client
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.local_ttl = local_ttl if local_ttl is not None else ttl
+        self.stats_interval = stats_interval
+        self.invalidations = invalidations
+        self.listener = None
+        self.local = OrderedDict()
+        self.lock = Lock()
+        self.counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+        self.unpublished = dict.fromkeys(self.counters, 0)
+        self.last_publish = monotonic()
+
+    def shared_key(self, key):
+        return f'cache:{self.name}:{key}'
+
+    def get(self, key):
+        if self.invalidations and self.listener is None:
+            self._start_listener()
+        value = self._get(key)
+        self._publish_stats()
+        return value
+
+    def _get(self, key):
+        now = monotonic()
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.local.move_to_end(key)
+                    self._count('local_hits')
+                    return entry[1]
+                del self.local[key]
+        try:
+            value = self.redis.get(self.shared_key(key))
+        except redis.exceptions.RedisError:
+            value = None
+        if value is None:
+            with self.lock:
+                self._count('misses')
+            return None
+        value = json.loads(value)
+        with self.lock:
+            self._set_local(key, value, now)
+            self._count('shared_hits')
+        return value
+
+    def set(self, key, value, overwrite=True):
+        with self.lock:
+            self._set_local(key, value, monotonic())
+        try:
+            self.redis.set(self.shared_key(key), json.dumps(value),
+                           ex=self.ttl, nx=not overwrite)
+        except redis.exceptions.RedisError:
+            pass
+
+    def replace(self, key, value):
+        # unlike set() and delete(), failures to reach Redis are raised, as
+        # other processes could otherwise keep serving the old value
+        pipeline = self.redis.pipeline()
+        pipeline.set(self.shared_key(key), json.dumps(value), ex=self.ttl)
+        if self.invalidations:
+            pipeline.publish(self.invalidation_channel, key)
+        pipeline.execute()
+        with self.lock:
+            self._set_local(key, value, monotonic())
+
+    def delete(self, key):
+        with self.lock:
+            self.local.pop(key, None)
+        try:
+            self.redis.delete(self.shared_key(key))
+            if self.invalidations:
+                self.redis.publish(self.invalidation_channel, key)
+        except redis.exceptions.RedisError:
+            pass
+
+    @property
+    def invalidation_channel(self):
+        return f'cache:{self.name}:invalidate'
+
+    def _start_listener(self):
+        with self.lock:
+            if self.listener is not None:
+                return
+            self.listener = Thread(target=self._listen, daemon=True)
+        self.listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.invalidation_channel)
+                # deletions may have been missed while disconnected
+                with self.lock:
+                    self.local.clear()
+                for message in pubsub.listen():
+                    with self.lock:
+                        self.local.pop(message['data'].decode('utf-8'), None)
+            except redis.exceptions.RedisError:
+                sleep(5)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, size=len(self.local))
+
+    @staticmethod
+    def shared_stats(redis_client):
+        stats = {}
+        for key in redis_client.scan_iter(match='cache:*:stats'):
+            name = key.decode('utf-8').split(':')[1]
+            stats[name] = {field.decode('utf-8'): int(value)
+                           for field, value in
+                           redis_client.hgetall(key).items()}
+        return stats
+
+    def _set_local(self, key, value, now):
+        self.local[key] = (now + self.local_ttl, value)
+        self.local.move_to_end(key)
+        while len(self.local) > self.maxsize:
+            self.local.popitem(last=False)
+
+    def _count(self, counter):
+        self.counters[counter] += 1
+        self.unpublished[counter] += 1
+
+    def _publish_stats(self):
+        with self.lock:
+            if monotonic() - self.last_publish < self.stats_interval:
+                return
+            unpublished = self.unpublished
+            self.unpublished = dict.fromkeys(self.counters, 0)
+            self.last_publish = monotonic()
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for field, value in unpublished.items():
+                pipeline.hincrby(f'cache:{self.name}:stats', field, value)
+            pipeline.execute()
+        except redis.exceptions.RedisError:
+            pass
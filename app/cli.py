@@ -1,6 +1,12 @@
+from datetime import datetime, timezone
 import os
-from flask import Blueprint
+from flask import Blueprint, current_app
 import click
+import sqlalchemy as sa
+from app import autocomplete, db
+from app.cache import TwoTierCache
+from app.models import User, Post, SearchableMixin, SearchOutbox
+from app.search import RebuildInProgress
 
 bp = Blueprint('cli', __name__, cli_group=None)
 
@@ -38,3 +44,181 @@ def compile():
     """Compile all languages."""
     if os.system('pybabel compile -d app/translations'):
         raise RuntimeError('compile command failed')
+
+
+@bp.cli.group()
+def timeline():
+    """Home timeline commands."""
+    pass
+
+
+@timeline.command()
+def rebuild():
+    """Rebuild the materialized home timelines of all users."""
+    for user in db.session.scalars(sa.select(User)):
+        user.rebuild_timeline()
+        db.session.commit()
+
+
+@bp.cli.group()
+def counters():
+    """User counter commands."""
+    pass
+
+
+@counters.command()
+def backfill():
+    """Recompute the follower, following and post counters of all users."""
+    db.session.execute(sa.update(User).values(**User.actual_counts()))
+    db.session.commit()
+
+
+@counters.command()
+@click.option('--dry-run', is_flag=True,
+              help='Report drift without repairing it.')
+def verify(dry_run):
+    """Find and repair drift in the user counters."""
+    actual = User.actual_counts()
+    query = sa.select(User.id, User.username,
+                      *[getattr(User, name) for name in actual],
+                      *actual.values()).where(sa.or_(
+                          *[getattr(User, name) != count
+                            for name, count in actual.items()]))
+    drifted = []
+    for row in db.session.execute(query):
+        stored, counted = row[2:2 + len(actual)], row[2 + len(actual):]
+        for name, have, want in zip(actual, stored, counted):
+            if have != want:
+                click.echo(f'{row.username}: {name} is {have}, '
+                           f'should be {want}')
+        drifted.append(row.id)
+    if not drifted:
+        click.echo('No counter drift found.')
+    elif not dry_run:
+        db.session.execute(sa.update(User).where(User.id.in_(drifted)).values(
+            **actual))
+        db.session.commit()
+        click.echo(f'Repaired counters of {len(drifted)} user(s).')
+
+
+@bp.cli.group()
+def posts():
+    """Post commands."""
+    pass
+
+
+@posts.command('detect-languages')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Number of posts to update per transaction.')
+def detect_languages(batch_size):
+    """Detect the language of posts that do not have one."""
+    count = 0
+    last_id = 0
+    while True:
+        batch = db.session.scalars(
+            sa.select(Post)
+            .where(Post.id > last_id,
+                   sa.or_(Post.language.is_(None), Post.language == ''))
+            .order_by(Post.id).limit(batch_size)).all()
+        if not batch:
+            break
+        for post in batch:
+            post.language = current_app.language_detector.detect(post.body)
+        last_id = batch[-1].id
+        db.session.commit()
+        count += len(batch)
+    click.echo(f'Processed {count} posts.')
+
+
+@bp.cli.group()
+def users():
+    """User commands."""
+    pass
+
+
+@users.command('rebuild-autocomplete')
+def rebuild_autocomplete():
+    """Rebuild the username autocomplete index."""
+    count = autocomplete.rebuild(db.session.execute(
+        sa.select(User.id, User.username).execution_options(yield_per=10000)))
+    click.echo(f'Indexed {count} usernames.')
+
+
+@bp.cli.group()
+def cache():
+    """Cache commands."""
+    pass
+
+
+@cache.command()
+def stats():
+    """Show the hit and miss counters of the shared caches."""
+    for name, counters in sorted(
+            TwoTierCache.shared_stats(current_app.redis).items()):
+        click.echo('{}: {}'.format(name, ', '.join(
+            f'{counter}={value}' for counter, value in sorted(
+                counters.items()))))
+
+
+@bp.cli.group()
+def search():
+    """Search index commands."""
+    pass
+
+
+@search.command()
+def outbox():
+    """Show the search indexing outbox backlog."""
+    max_attempts = current_app.config['SEARCH_OUTBOX_MAX_ATTEMPTS']
+    query = sa.select(
+        SearchOutbox.index_name, SearchOutbox.operation,
+        SearchOutbox.attempts >= max_attempts, sa.func.count(),
+        sa.func.min(SearchOutbox.timestamp)).group_by(
+            SearchOutbox.index_name, SearchOutbox.operation,
+            SearchOutbox.attempts >= max_attempts)
+    rows = db.session.execute(query).all()
+    if not rows:
+        click.echo('The search outbox is empty.')
+    for index, operation, failed, count, oldest in rows:
+        click.echo('{} {}: {} pending{}, oldest from {}'.format(
+            index, operation, count, ' (out of attempts)' if failed else '',
+            datetime.fromtimestamp(oldest, timezone.utc).isoformat()))
+
+
+@search.command()
+@click.option('--retry-failed', is_flag=True,
+              help='Also replay entries that ran out of attempts.')
+def replay(retry_failed):
+    """Replay the search indexing outbox backlog."""
+    if retry_failed:
+        db.session.execute(sa.update(SearchOutbox).values(attempts=0))
+        db.session.commit()
+    click.echo(f'Processed {SearchOutbox.process()} outbox entries.')
+
+
+@search.command()
+@click.option('--workers', default=4, show_default=True,
+              help='Number of concurrent bulk requests.')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Number of documents per bulk request.')
+@click.option('--resume', is_flag=True,
+              help='Continue an interrupted rebuild from its checkpoint.')
+@click.option('--keep-old', is_flag=True,
+              help='Do not delete the indexes that were replaced.')
+def reindex(workers, batch_size, resume, keep_old):
+    """Rebuild the search indexes and swap them in atomically."""
+    if not current_app.elasticsearch:
+        raise click.ClickException('Elasticsearch is not configured.')
+    for model in SearchableMixin.searchable_models():
+        def progress(done, total):
+            click.echo('\r{}: {}/{}'.format(model.__tablename__, done, total),
+                       nl=False)
+
+        try:
+            index = model.reindex(workers=workers, batch_size=batch_size,
+                                  resume=resume, keep_old=keep_old,
+                                  progress=progress)
+        except RebuildInProgress as e:
+            raise click.ClickException(str(e))
+        click.echo(f'\n{model.__tablename__} now points to {index}.')
+    click.echo(f'Processed {SearchOutbox.process()} outbox entries.')
@@ -0,0 +1,60 @@
+import json
+from uuid import uuid4
+from flask import current_app
+
+CHUNK_SIZE = 64 * 1024
+# how long a replaced export stays readable for downloads already started
+REPLACED_EXPORT_TTL = 600
+
+
+def _key(user_id):
+    return f'exports:posts:{user_id}'
+
+
+def export_format():
+    if current_app.config['EXPORT_POSTS_GZIP']:
+        return 'posts.json.gz', 'application/gzip'
+    return 'posts.json', 'application/json'
+
+
+# exports are written by the worker and downloaded through the web
+# processes, Redis is the only storage they are guaranteed to share
+def store_export(user_id, fileobj):
+    ttl = current_app.config['EXPORT_POSTS_TTL']
+    filename, content_type = export_format()
+    data_key = '{}:{}'.format(_key(user_id), uuid4().hex)
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        pipeline = current_app.redis.pipeline(transaction=False)
+        pipeline.append(data_key, chunk)
+        # an upload that is interrupted expires on its own
+        pipeline.expire(data_key, ttl)
+        pipeline.execute()
+    pipeline = current_app.redis.pipeline()
+    pipeline.get(_key(user_id))
+    pipeline.set(_key(user_id), json.dumps({
+        'key': data_key, 'filename': filename,
+        'content_type': content_type}), ex=ttl)
+    previous, _ = pipeline.execute()
+    if previous is not None:
+        current_app.redis.expire(json.loads(previous)['key'],
+                                 REPLACED_EXPORT_TTL)
+
+
+def load_export(user_id):
+    export = current_app.redis.get(_key(user_id))
+    if export is None:
+        return None
+    export = json.loads(export)
+    size = current_app.redis.strlen(export['key'])
+    if not size:
+        return None
+
+    def chunks():
+        for start in range(0, size, CHUNK_SIZE):
+            yield current_app.redis.getrange(export['key'], start,
+                                             start + CHUNK_SIZE - 1)
+
+    return export['filename'], export['content_type'], size, chunks()
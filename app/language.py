@@ -0,0 +1,34 @@
+from functools import lru_cache
+from hashlib import sha256
+from langdetect.detector_factory import DetectorFactory, PROFILES_DIRECTORY
+from langdetect.lang_detect_exception import LangDetectException
+
+
+# profiles take a while to load, so they are shared by all the app instances
+@lru_cache(maxsize=None)
+def _factory(seed):
+    factory = DetectorFactory()
+    factory.load_profile(PROFILES_DIRECTORY)
+    factory.set_seed(seed)
+    return factory
+
+
+class LanguageDetector:
+    def __init__(self, cache, seed=0):
+        self.factory = _factory(seed)
+        self.cache = cache
+
+    def detect(self, text):
+        key = sha256(text.encode('utf-8')).hexdigest()
+        language = self.cache.get(key)
+        if language is None:
+            detector = self.factory.create()
+            detector.append(text)
+            try:
+                language = detector.detect()
+            except LangDetectException:
+                language = ''
+            if language == detector.UNKNOWN_LANG:
+                language = ''
+            self.cache.set(key, language)
+        return language
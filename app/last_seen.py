@@ -0,0 +1,63 @@
+import atexit
+from threading import Lock, Timer
+from time import monotonic
+from flask import current_app
+import sqlalchemy as sa
+from app import db
+from app.models import User
+
+
+class LastSeenBuffer:
+    def __init__(self, app, flush_interval=60):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.lock = Lock()
+        self.last_flush = monotonic()
+        self.timer = None
+        atexit.register(self.flush_in_background)
+
+    def record(self, user_id, timestamp):
+        with self.lock:
+            self.pending[user_id] = timestamp
+            due = monotonic() - self.last_flush >= self.flush_interval
+            if not due:
+                self._start_timer()
+        if due:
+            self.flush()
+
+    def _start_timer(self):
+        # an idle worker still writes its timestamps within one interval
+        if self.timer is None:
+            self.timer = Timer(self.flush_interval, self.flush_in_background)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush_in_background(self):
+        with self.app.app_context():
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = monotonic()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not pending:
+            return
+        try:
+            db.session.execute(sa.update(User), [
+                {'id': user_id, 'last_seen': timestamp}
+                for user_id, timestamp in pending.items()])
+            db.session.commit()
+        except sa.exc.SQLAlchemyError:
+            # best effort, the timestamps are retried on the next flush
+            db.session.rollback()
+            with self.lock:
+                for user_id, timestamp in pending.items():
+                    self.pending.setdefault(user_id, timestamp)
+                self._start_timer()
+            current_app.logger.warning(
+                'Could not write last_seen for %d users', len(pending),
+                exc_info=True)
@@ -1,23 +1,29 @@
 from datetime import datetime, timezone
+import json
+import time
 from flask import render_template, flash, redirect, url_for, request, g, \
-    current_app
+    current_app, abort, Response, stream_with_context
 from flask_login import current_user, login_required
 from flask_babel import _, get_locale
 import sqlalchemy as sa
-from langdetect import detect, LangDetectException
+import redis
 from app import db
 from app.main.forms import EditProfileForm, EmptyForm, PostForm, SearchForm, \
     MessageForm
 from app.models import User, Post, Message, Notification
-from app.translate import translate
+from app.pagination import cursor_paginate
+from app.api.errors import bad_request
+from app.exports import load_export
+from app.translate import translate, translate_batch, MAX_BATCH_ITEMS, \
+    MAX_BATCH_CHARACTERS
 from app.main import bp
 
 
 @bp.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.now(timezone.utc)
-        db.session.commit()
+        current_app.last_seen.record(current_user.id,
+                                     datetime.now(timezone.utc))
         g.search_form = SearchForm()
     g.locale = str(get_locale())
 
@@ -28,23 +34,29 @@ def before_request():
 def index():
     form = PostForm()
     if form.validate_on_submit():
-        try:
-            language = detect(form.post.data)
-        except LangDetectException:
-            language = ''
+        language = None
+        if not current_app.config['LANGUAGE_DETECTION_ASYNC']:
+            language = current_app.language_detector.detect(form.post.data)
         post = Post(body=form.post.data, author=current_user,
                     language=language)
         db.session.add(post)
         db.session.commit()
+        if language is None:
+            try:
+                current_app.task_queue.enqueue('app.tasks.detect_languages',
+                                               [post.id])
+            except redis.exceptions.RedisError:
+                # 'flask posts detect-languages' will catch up
+                pass
         flash(_('Your post is now live!'))
         return redirect(url_for('main.index'))
-    page = request.args.get('page', 1, type=int)
-    posts = db.paginate(current_user.following_posts(), page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'],
-                        error_out=False)
-    next_url = url_for('main.index', page=posts.next_num) \
+    cursor = request.args.get('cursor')
+    posts = cursor_paginate(current_user.timeline_posts(),
+                            (Post.timestamp, Post.id), cursor,
+                            current_app.config['POSTS_PER_PAGE'])
+    next_url = url_for('main.index', cursor=posts.next_cursor) \
         if posts.has_next else None
-    prev_url = url_for('main.index', page=posts.prev_num) \
+    prev_url = url_for('main.index', cursor=posts.prev_cursor) \
         if posts.has_prev else None
     return render_template('index.html', title=_('Home'), form=form,
                            posts=posts.items, next_url=next_url,
@@ -54,14 +66,13 @@ def index():
 @bp.route('/explore')
 @login_required
 def explore():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     query = sa.select(Post).order_by(Post.timestamp.desc())
-    posts = db.paginate(query, page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'],
-                        error_out=False)
-    next_url = url_for('main.explore', page=posts.next_num) \
+    posts = cursor_paginate(query, (Post.timestamp, Post.id), cursor,
+                            current_app.config['POSTS_PER_PAGE'])
+    next_url = url_for('main.explore', cursor=posts.next_cursor) \
         if posts.has_next else None
-    prev_url = url_for('main.explore', page=posts.prev_num) \
+    prev_url = url_for('main.explore', cursor=posts.prev_cursor) \
         if posts.has_prev else None
     return render_template('index.html', title=_('Explore'),
                            posts=posts.items, next_url=next_url,
@@ -72,15 +83,14 @@ def explore():
 @login_required
 def user(username):
     user = db.first_or_404(sa.select(User).where(User.username == username))
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     query = user.posts.select().order_by(Post.timestamp.desc())
-    posts = db.paginate(query, page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'],
-                        error_out=False)
+    posts = cursor_paginate(query, (Post.timestamp, Post.id), cursor,
+                            current_app.config['POSTS_PER_PAGE'])
     next_url = url_for('main.user', username=user.username,
-                       page=posts.next_num) if posts.has_next else None
+                       cursor=posts.next_cursor) if posts.has_next else None
     prev_url = url_for('main.user', username=user.username,
-                       page=posts.prev_num) if posts.has_prev else None
+                       cursor=posts.prev_cursor) if posts.has_prev else None
     form = EmptyForm()
     return render_template('user.html', user=user, posts=posts.items,
                            next_url=next_url, prev_url=prev_url, form=form)
@@ -162,20 +172,44 @@ def translate_text():
                               data['dest_language'])}
 
 
+@bp.route('/translate/batch', methods=['POST'])
+@login_required
+def translate_text_batch():
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return bad_request('the request must contain a list of items')
+    if len(items) > MAX_BATCH_ITEMS:
+        return bad_request('at most {} items can be translated at once'
+                           .format(MAX_BATCH_ITEMS))
+    for item in items:
+        if not isinstance(item, dict) or not all(
+                isinstance(item.get(field), str) for field in
+                ('text', 'source_language', 'dest_language')):
+            return bad_request('each item must have text, source_language '
+                               'and dest_language strings')
+        if len(item['text']) > MAX_BATCH_CHARACTERS:
+            return bad_request('each text can have at most {} characters'
+                               .format(MAX_BATCH_CHARACTERS))
+    return {'translations': translate_batch(items)}
+
+
 @bp.route('/search')
 @login_required
 def search():
     if not g.search_form.validate():
         return redirect(url_for('main.explore'))
-    page = request.args.get('page', 1, type=int)
-    posts, total = Post.search(g.search_form.q.data, page,
-                               current_app.config['POSTS_PER_PAGE'])
-    next_url = url_for('main.search', q=g.search_form.q.data, page=page + 1) \
-        if total > page * current_app.config['POSTS_PER_PAGE'] else None
-    prev_url = url_for('main.search', q=g.search_form.q.data, page=page - 1) \
-        if page > 1 else None
-    return render_template('search.html', title=_('Search'), posts=posts,
-                           next_url=next_url, prev_url=prev_url)
+    cursor = request.args.get('cursor')
+    posts, total = Post.search_page(g.search_form.q.data, cursor,
+                                    current_app.config['POSTS_PER_PAGE'],
+                                    from_index=True)
+    next_url = url_for('main.search', q=g.search_form.q.data,
+                       cursor=posts.next_cursor) if posts.has_next else None
+    prev_url = url_for('main.search', q=g.search_form.q.data,
+                       cursor=posts.prev_cursor) if posts.has_prev else None
+    return render_template('search.html', title=_('Search'),
+                           posts=posts.items, next_url=next_url,
+                           prev_url=prev_url)
 
 
 @bp.route('/send_message/<recipient>', methods=['GET', 'POST'])
@@ -202,15 +236,14 @@ def messages():
     current_user.last_message_read_time = datetime.now(timezone.utc)
     current_user.add_notification('unread_message_count', 0)
     db.session.commit()
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     query = current_user.messages_received.select().order_by(
         Message.timestamp.desc())
-    messages = db.paginate(query, page=page,
-                           per_page=current_app.config['POSTS_PER_PAGE'],
-                           error_out=False)
-    next_url = url_for('main.messages', page=messages.next_num) \
+    messages = cursor_paginate(query, (Message.timestamp, Message.id),
+                               cursor, current_app.config['POSTS_PER_PAGE'])
+    next_url = url_for('main.messages', cursor=messages.next_cursor) \
         if messages.has_next else None
-    prev_url = url_for('main.messages', page=messages.prev_num) \
+    prev_url = url_for('main.messages', cursor=messages.prev_cursor) \
         if messages.has_prev else None
     return render_template('messages.html', messages=messages.items,
                            next_url=next_url, prev_url=prev_url)
@@ -222,11 +255,29 @@ def export_posts():
     if current_user.get_task_in_progress('export_posts'):
         flash(_('An export task is currently in progress'))
     else:
-        current_user.launch_task('export_posts', _('Exporting posts...'))
+        current_user.launch_task(
+            'export_posts', _('Exporting posts...'),
+            url_for('main.download_export', _external=True))
         db.session.commit()
     return redirect(url_for('main.user', username=current_user.username))
 
 
+@bp.route('/export_posts/download')
+@login_required
+def download_export():
+    try:
+        export = load_export(current_user.id)
+    except redis.exceptions.RedisError:
+        abort(503)
+    if export is None:
+        abort(404)
+    filename, content_type, size, chunks = export
+    return Response(stream_with_context(chunks), mimetype=content_type,
+                    headers={'Content-Length': str(size),
+                             'Content-Disposition':
+                             f'attachment; filename={filename}'})
+
+
 @bp.route('/notifications')
 @login_required
 def notifications():
@@ -239,3 +290,49 @@ def notifications():
         'data': n.get_data(),
         'timestamp': n.timestamp
     } for n in notifications]
+
+
+@bp.route('/notifications/stream')
+@login_required
+def notifications_stream():
+    since = request.headers.get('Last-Event-ID', type=float) or \
+        request.args.get('since', 0.0, type=float)
+    pubsub = current_app.redis.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(Notification.channel(current_user.id))
+    except redis.exceptions.RedisError:
+        abort(503)
+    query = current_user.notifications.select().where(
+        Notification.timestamp > since).order_by(Notification.timestamp.asc())
+    backlog = [{
+        'name': n.name,
+        'data': n.get_data(),
+        'timestamp': n.timestamp
+    } for n in db.session.scalars(query)]
+    db.session.close()
+    keepalive = current_app.config['NOTIFICATIONS_STREAM_KEEPALIVE']
+    deadline = time.monotonic() + \
+        current_app.config['NOTIFICATIONS_STREAM_TIMEOUT']
+
+    def events():
+        try:
+            for notification in backlog:
+                yield 'id: {}\ndata: {}\n\n'.format(
+                    notification['timestamp'], json.dumps(notification))
+            while time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=keepalive)
+                if message is None:
+                    yield ': keepalive\n\n'
+                    continue
+                notification = json.loads(message['data'])
+                yield 'id: {}\ndata: {}\n\n'.format(
+                    notification['timestamp'], json.dumps(notification))
+        except redis.exceptions.RedisError:
+            pass
+        finally:
+            pubsub.close()
+
+    return Response(stream_with_context(events()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
@@ -1,5 +1,5 @@
 from datetime import datetime, timezone, timedelta
-from hashlib import md5
+from hashlib import md5, sha256
 import json
 import secrets
 from time import time
@@ -8,20 +8,25 @@ import sqlalchemy as sa
 import sqlalchemy.orm as so
 from flask import current_app, url_for
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import redis
 import rq
-from app import db, login
-from app.search import add_to_index, remove_from_index, query_index
+from app import autocomplete, db, login
+from app.pagination import cursor_paginate
+from app.search import add_full_text_index, bump_index_generation, \
+    cached_query_hits, cached_query_page, document, rebuild_index, \
+    rebuild_status
 
 
 class SearchableMixin:
     @classmethod
-    def search(cls, expression, page, per_page):
-        ids, total = query_index(cls.__tablename__, expression, page, per_page)
-        if total == 0:
-            return [], 0
+    def search(cls, expression, page, per_page, from_index=False):
+        hits, total = cached_query_hits(cls, expression, page, per_page)
+        if from_index:
+            return cls.load_search_hits(hits), total
+        ids = [id for id, source in hits]
+        if not ids:
+            return [], total
         when = []
         for i in range(len(ids)):
             when.append((ids[i], i))
@@ -30,43 +35,100 @@ class SearchableMixin:
         return db.session.scalars(query), total
 
     @classmethod
-    def before_commit(cls, session):
-        session._changes = {
-            'add': list(session.new),
-            'update': list(session.dirty),
-            'delete': list(session.deleted)
-        }
+    def search_page(cls, expression, cursor, per_page, from_index=False):
+        page, total = cached_query_page(cls, expression, cursor, per_page)
+        page.items = cls.load_search_hits(page.items, from_index)
+        return page, total
 
     @classmethod
-    def after_commit(cls, session):
-        for obj in session._changes['add']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['update']:
+    def load_search_hits(cls, hits, from_index=True):
+        results = {id: cls.from_search_hit(id, source)
+                   for id, source in hits
+                   if from_index and source is not None}
+        stale_ids = [id for id, source in hits if results.get(id) is None]
+        if stale_ids:
+            results.update((obj.id, obj) for obj in db.session.scalars(
+                sa.select(cls).where(cls.id.in_(stale_ids))))
+        return [results[id] for id, source in hits
+                if results.get(id) is not None]
+
+    @classmethod
+    def from_search_hit(cls, id, source):
+        return None
+
+    def stored_search_fields(self):
+        return {}
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        changes = []
+        for obj in session.new:
             if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['delete']:
+                changes.append((obj, 'index'))
+        for obj in session.dirty:
+            if isinstance(obj, SearchableMixin) and session.is_modified(obj):
+                changes.append((obj, 'index'))
+        for obj in session.deleted:
             if isinstance(obj, SearchableMixin):
-                remove_from_index(obj.__tablename__, obj)
-        session._changes = None
+                changes.append((obj, 'delete'))
+        if not changes:
+            return
+        session.info.setdefault('search_indexes', set()).update(
+            obj.__tablename__ for obj, operation in changes)
+        if current_app.search.uses_outbox:
+            session.connection().execute(SearchOutbox.__table__.insert(), [
+                {'index_name': obj.__tablename__, 'object_id': obj.id,
+                 'operation': operation} for obj, operation in changes])
+            session.info['search_outbox'] = True
+        if current_app.search.tracks_changes:
+            session.info.setdefault('search_changes', []).extend(
+                (type(obj), obj.id,
+                 document(obj) if operation == 'index' else None)
+                for obj, operation in changes)
 
     @classmethod
-    def reindex(cls):
-        for obj in db.session.scalars(sa.select(cls)):
-            add_to_index(cls.__tablename__, obj)
+    def after_commit(cls, session):
+        if session.info.pop('search_outbox', False):
+            SearchOutbox.schedule()
+        changes = session.info.pop('search_changes', None)
+        if changes:
+            current_app.search.apply(changes)
+        indexes = session.info.pop('search_indexes', None)
+        if indexes and not current_app.search.uses_outbox:
+            bump_index_generation(*indexes)
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop('search_outbox', None)
+        session.info.pop('search_changes', None)
+        session.info.pop('search_indexes', None)
+
+    @classmethod
+    def reindex(cls, **kwargs):
+        return rebuild_index(cls, **kwargs)
+
+    @staticmethod
+    def searchable_models():
+        return [mapper.class_ for mapper in db.Model.registry.mappers
+                if issubclass(mapper.class_, SearchableMixin)]
 
 
-db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
+db.event.listen(db.session, 'after_flush', SearchableMixin.after_flush)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+db.event.listen(db.session, 'after_rollback', SearchableMixin.after_rollback)
 
 
 class PaginatedAPIMixin(object):
-    @staticmethod
-    def to_collection_dict(query, page, per_page, endpoint, **kwargs):
+    @classmethod
+    def to_collection_dict(cls, query, page, per_page, endpoint, cursor=None,
+                           **kwargs):
+        if cursor is not None:
+            return cls.to_cursor_collection_dict(query, cursor, per_page,
+                                                 endpoint, **kwargs)
         resources = db.paginate(query, page=page, per_page=per_page,
                                 error_out=False)
         data = {
-            'items': [item.to_dict() for item in resources.items],
+            'items': cls.to_dict_collection(resources.items),
             '_meta': {
                 'page': page,
                 'per_page': per_page,
@@ -84,6 +146,39 @@ class PaginatedAPIMixin(object):
         }
         return data
 
+    @classmethod
+    def to_dict_collection(cls, items):
+        return [item.to_dict() for item in items]
+
+    @classmethod
+    def to_cursor_collection_dict(cls, query, cursor, per_page, endpoint,
+                                  **kwargs):
+        resources = cursor_paginate(query, (cls.id,), cursor, per_page,
+                                    descending=False)
+        data = {
+            'items': cls.to_dict_collection(resources.items),
+            '_meta': {
+                'per_page': per_page,
+                'next_cursor': resources.next_cursor,
+                'prev_cursor': resources.prev_cursor
+            },
+            '_links': {
+                'self': url_for(endpoint, cursor=cursor, per_page=per_page,
+                                **kwargs),
+                'next': url_for(endpoint, cursor=resources.next_cursor,
+                                per_page=per_page, **kwargs)
+                if resources.has_next else None,
+                'prev': url_for(endpoint, cursor=resources.prev_cursor,
+                                per_page=per_page, **kwargs)
+                if resources.has_prev else None
+            }
+        }
+        return data
+
+
+def gravatar(digest, size):
+    return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
+
 
 followers = sa.Table(
     'followers',
@@ -91,14 +186,28 @@ followers = sa.Table(
     sa.Column('follower_id', sa.Integer, sa.ForeignKey('user.id'),
               primary_key=True),
     sa.Column('followed_id', sa.Integer, sa.ForeignKey('user.id'),
-              primary_key=True)
+              primary_key=True),
+    sa.Index('ix_followers_followed_id_follower_id', 'followed_id',
+             'follower_id')
+)
+
+timeline_entry = sa.Table(
+    'timeline_entry',
+    db.metadata,
+    sa.Column('user_id', sa.Integer, sa.ForeignKey('user.id'),
+              primary_key=True),
+    sa.Column('post_id', sa.Integer, sa.ForeignKey('post.id'),
+              primary_key=True),
+    sa.Column('timestamp', sa.DateTime, nullable=False),
+    sa.Index('ix_timeline_entry_user_id_timestamp', 'user_id', 'timestamp')
 )
 
 
 class User(PaginatedAPIMixin, UserMixin, db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     username: so.Mapped[str] = so.mapped_column(sa.String(64), index=True,
-                                                unique=True)
+                                                unique=True,
+                                                active_history=True)
     email: so.Mapped[str] = so.mapped_column(sa.String(120), index=True,
                                              unique=True)
     password_hash: so.Mapped[Optional[str]] = so.mapped_column(sa.String(256))
@@ -109,6 +218,12 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     token: so.Mapped[Optional[str]] = so.mapped_column(
         sa.String(32), index=True, unique=True)
     token_expiration: so.Mapped[Optional[datetime]]
+    num_followers: so.Mapped[int] = so.mapped_column(default=0,
+                                                     server_default='0')
+    num_following: so.Mapped[int] = so.mapped_column(default=0,
+                                                     server_default='0')
+    num_posts: so.Mapped[int] = so.mapped_column(default=0,
+                                                 server_default='0')
 
     posts: so.WriteOnlyMapped['Post'] = so.relationship(
         back_populates='author')
@@ -132,52 +247,102 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return '<User {}>'.format(self.username)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = current_app.passwords.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if self.password_hash is None:
+            return False
+        if not current_app.passwords.verify(self.username, self.password_hash,
+                                            password):
+            return False
+        if current_app.passwords.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
+
+    @property
+    def avatar_digest(self):
+        return md5(self.email.lower().encode('utf-8')).hexdigest()
 
     def avatar(self, size):
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
+        return gravatar(self.avatar_digest, size)
 
     def follow(self, user):
         if not self.is_following(user):
             self.following.add(user)
+            self.adjust_counter('num_following', 1)
+            user.adjust_counter('num_followers', 1)
+            db.session.execute(timeline_entry.insert().from_select(
+                ['user_id', 'post_id', 'timestamp'],
+                sa.select(sa.literal(self.id), Post.id, Post.timestamp)
+                .where(Post.user_id == user.id)
+                .order_by(Post.timestamp.desc())
+                .limit(current_app.config['TIMELINE_LENGTH'])))
+            trim_timelines(db.session, User.id == self.id)
 
     def unfollow(self, user):
         if self.is_following(user):
             self.following.remove(user)
+            self.adjust_counter('num_following', -1)
+            user.adjust_counter('num_followers', -1)
+            db.session.execute(timeline_entry.delete().where(
+                timeline_entry.c.user_id == self.id,
+                timeline_entry.c.post_id.in_(
+                    sa.select(Post.id).where(Post.user_id == user.id))))
+
+    def adjust_counter(self, name, delta):
+        # atomic in the database, then reloaded so this request sees it
+        column = getattr(User, name)
+        db.session.execute(
+            sa.update(User).where(User.id == self.id)
+            .values({column: column + delta})
+            .execution_options(synchronize_session=False))
+        db.session.expire(self, [name])
 
     def is_following(self, user):
         query = self.following.select().where(User.id == user.id)
         return db.session.scalar(query) is not None
 
     def followers_count(self):
-        query = sa.select(sa.func.count()).select_from(
-            self.followers.select().subquery())
-        return db.session.scalar(query)
+        return self.num_followers
 
     def following_count(self):
-        query = sa.select(sa.func.count()).select_from(
-            self.following.select().subquery())
-        return db.session.scalar(query)
+        return self.num_following
 
     def following_posts(self):
-        Author = so.aliased(User)
-        Follower = so.aliased(User)
+        followed = sa.select(followers.c.followed_id).where(
+            followers.c.follower_id == self.id)
         return (
             sa.select(Post)
-            .join(Post.author.of_type(Author))
-            .join(Author.followers.of_type(Follower), isouter=True)
             .where(sa.or_(
-                Follower.id == self.id,
-                Author.id == self.id,
+                Post.user_id.in_(followed),
+                Post.user_id == self.id,
             ))
-            .group_by(Post)
             .order_by(Post.timestamp.desc())
         )
 
+    def timeline_posts(self):
+        entries = (
+            sa.select(timeline_entry.c.post_id)
+            .where(timeline_entry.c.user_id == self.id)
+            .order_by(timeline_entry.c.timestamp.desc())
+            .limit(current_app.config['TIMELINE_LENGTH'])
+            .subquery()
+        )
+        return (
+            sa.select(Post)
+            .join(entries, Post.id == entries.c.post_id)
+            .order_by(Post.timestamp.desc())
+        )
+
+    def rebuild_timeline(self):
+        db.session.execute(timeline_entry.delete().where(
+            timeline_entry.c.user_id == self.id))
+        db.session.execute(timeline_entry.insert().from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            self.following_posts()
+            .with_only_columns(sa.literal(self.id), Post.id, Post.timestamp)
+            .limit(current_app.config['TIMELINE_LENGTH'])))
+
     def get_reset_password_token(self, expires_in=600):
         return jwt.encode(
             {'reset_password': self.id, 'exp': time() + expires_in},
@@ -202,8 +367,11 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     def add_notification(self, name, data):
         db.session.execute(self.notifications.delete().where(
             Notification.name == name))
-        n = Notification(name=name, payload_json=json.dumps(data), user=self)
+        n = Notification(name=name, payload_json=json.dumps(data), user=self,
+                         timestamp=time())
         db.session.add(n)
+        db.session.info.setdefault('notifications', []).append(
+            (self.id, {'name': name, 'data': data, 'timestamp': n.timestamp}))
         return n
 
     def launch_task(self, name, description, *args, **kwargs):
@@ -224,11 +392,43 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return db.session.scalar(query)
 
     def posts_count(self):
-        query = sa.select(sa.func.count()).select_from(
-            self.posts.select().subquery())
-        return db.session.scalar(query)
+        return self.num_posts
 
-    def to_dict(self, include_email=False):
+    @staticmethod
+    def actual_counts():
+        followers_count = sa.select(sa.func.count()).where(
+            followers.c.followed_id == User.id).scalar_subquery()
+        following_count = sa.select(sa.func.count()).where(
+            followers.c.follower_id == User.id).scalar_subquery()
+        posts_count = sa.select(sa.func.count()).where(
+            Post.user_id == User.id).scalar_subquery()
+        return {'num_followers': followers_count,
+                'num_following': following_count,
+                'num_posts': posts_count}
+
+    @staticmethod
+    def link_templates():
+        placeholder = 123456789
+        return {
+            name: url_for(endpoint, id=placeholder).partition(
+                str(placeholder))[::2]
+            for name, endpoint in [('self', 'api.get_user'),
+                                   ('followers', 'api.get_followers'),
+                                   ('following', 'api.get_following')]
+        }
+
+    @classmethod
+    def to_dict_collection(cls, users):
+        link_templates = cls.link_templates()
+        return [user.to_dict(link_templates=link_templates)
+                for user in users]
+
+    def to_dict(self, include_email=False, link_templates=None):
+        if link_templates is None:
+            link_templates = User.link_templates()
+        links = {name: f'{prefix}{self.id}{suffix}'
+                 for name, (prefix, suffix) in link_templates.items()}
+        links['avatar'] = self.avatar(128)
         data = {
             'id': self.id,
             'username': self.username,
@@ -238,12 +438,7 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             'post_count': self.posts_count(),
             'follower_count': self.followers_count(),
             'following_count': self.following_count(),
-            '_links': {
-                'self': url_for('api.get_user', id=self.id),
-                'followers': url_for('api.get_followers', id=self.id),
-                'following': url_for('api.get_following', id=self.id),
-                'avatar': self.avatar(128)
-            }
+            '_links': links
         }
         if include_email:
             data['email'] = self.email
@@ -256,29 +451,154 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         if new_user and 'password' in data:
             self.set_password(data['password'])
 
+    @classmethod
+    def autocomplete(cls, prefix, limit=10):
+        try:
+            results = autocomplete.lookup(prefix, limit)
+        except redis.exceptions.RedisError:
+            results = None
+        if results is None:
+            results = db.session.execute(
+                sa.select(cls.id, cls.username)
+                .where(cls.username >= prefix,
+                       cls.username < prefix + '\U0010ffff')
+                .order_by(cls.username).limit(limit)).all()
+        return results
+
+    @staticmethod
+    def after_commit(session):
+        for key in session.info.pop('revoked_tokens', ()):
+            current_app.token_cache.delete(key)
+        changes = session.info.pop('autocomplete', None)
+        if changes:
+            try:
+                autocomplete.update(changes)
+            except redis.exceptions.RedisError:
+                pass
+
+    @staticmethod
+    def after_rollback(session):
+        session.info.pop('revoked_tokens', None)
+        session.info.pop('autocomplete', None)
+
     def get_token(self, expires_in=3600):
+        if current_app.config['API_TOKEN_MODE'] == 'jwt':
+            return jwt.encode(
+                {'sub': str(self.id), 'jti': secrets.token_hex(8),
+                 'exp': time() + expires_in},
+                current_app.config['SECRET_KEY'], algorithm='HS256')
         now = datetime.now(timezone.utc)
         if self.token and self.token_expiration.replace(
                 tzinfo=timezone.utc) > now + timedelta(seconds=60):
             return self.token
+        if self.token:
+            self.invalidate_token(self.token)
         self.token = secrets.token_hex(16)
         self.token_expiration = now + timedelta(seconds=expires_in)
         db.session.add(self)
         return self.token
 
-    def revoke_token(self):
+    def revoke_token(self, token=None):
+        if token and '.' in token:
+            payload = User.decode_token(token)
+            if payload is not None:
+                pipeline = current_app.redis.pipeline()
+                pipeline.zadd('tokens:revoked',
+                              {payload['jti']: payload['exp']})
+                pipeline.zremrangebyscore('tokens:revoked', '-inf', time())
+                pipeline.execute()
+            return
         self.token_expiration = datetime.now(timezone.utc) - timedelta(
             seconds=1)
+        if self.token:
+            # an expired entry shadows the token in every process before
+            # the revocation is committed, RedisError aborts the revocation
+            current_app.token_cache.replace(
+                User.token_cache_key(self.token), [self.id, 0])
+
+    @staticmethod
+    def token_cache_key(token):
+        return sha256(token.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def invalidate_token(token):
+        db.session.info.setdefault('revoked_tokens', []).append(
+            User.token_cache_key(token))
+
+    @staticmethod
+    def decode_token(token):
+        try:
+            return jwt.decode(token, current_app.config['SECRET_KEY'],
+                              algorithms=['HS256'],
+                              options={'require': ['exp', 'sub', 'jti']})
+        except jwt.InvalidTokenError:
+            return None
+
+    @staticmethod
+    def unloaded(id):
+        # the user is only loaded from the database if it is used
+        user = User(id=id)
+        so.make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
 
     @staticmethod
     def check_token(token):
+        if '.' in token:
+            payload = User.decode_token(token)
+            if payload is None:
+                return None
+            try:
+                if current_app.redis.zscore('tokens:revoked',
+                                            payload['jti']) is not None:
+                    return None
+            except redis.exceptions.RedisError:
+                # revocations cannot be checked, so fail closed
+                return None
+            return User.unloaded(int(payload['sub']))
+        now = datetime.now(timezone.utc)
+        key = User.token_cache_key(token)
+        cached = current_app.token_cache.get(key)
+        if cached is not None:
+            user_id, expiration = cached
+            if expiration < now.timestamp():
+                return None
+            return User.unloaded(user_id)
         user = db.session.scalar(sa.select(User).where(User.token == token))
-        if user is None or user.token_expiration.replace(
-                tzinfo=timezone.utc) < datetime.now(timezone.utc):
+        if user is None:
+            return None
+        expiration = user.token_expiration.replace(tzinfo=timezone.utc)
+        if expiration < now:
             return None
+        # never overwrite an entry written by a concurrent revocation
+        current_app.token_cache.set(key, [user.id, expiration.timestamp()],
+                                    overwrite=False)
         return user
 
 
+@sa.event.listens_for(User, 'after_insert')
+def add_username(mapper, connection, user):
+    sa.inspect(user).session.info.setdefault('autocomplete', []).append(
+        (user.id, None, user.username))
+
+
+@sa.event.listens_for(User, 'after_update')
+def rename_username(mapper, connection, user):
+    history = sa.inspect(user).attrs.username.history
+    if history.deleted and history.added:
+        sa.inspect(user).session.info.setdefault('autocomplete', []).append(
+            (user.id, history.deleted[0], history.added[0]))
+
+
+@sa.event.listens_for(User, 'after_delete')
+def remove_username(mapper, connection, user):
+    sa.inspect(user).session.info.setdefault('autocomplete', []).append(
+        (user.id, user.username, None))
+
+
+db.event.listen(db.session, 'after_commit', User.after_commit)
+db.event.listen(db.session, 'after_rollback', User.after_rollback)
+
+
 @login.user_loader
 def load_user(id):
     return db.session.get(User, int(id))
@@ -286,33 +606,139 @@ def load_user(id):
 
 class Post(SearchableMixin, db.Model):
     __searchable__ = ['body']
+    __table_args__ = (
+        sa.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),
+    )
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     body: so.Mapped[str] = so.mapped_column(sa.String(140))
     timestamp: so.Mapped[datetime] = so.mapped_column(
         index=True, default=lambda: datetime.now(timezone.utc))
-    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
-                                               index=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
     language: so.Mapped[Optional[str]] = so.mapped_column(sa.String(5))
 
-    author: so.Mapped[User] = so.relationship(back_populates='posts')
+    author: so.Mapped[User] = so.relationship(back_populates='posts',
+                                              lazy='selectin')
 
     def __repr__(self):
         return '<Post {}>'.format(self.body)
 
+    def stored_search_fields(self):
+        return {'timestamp': self.timestamp.isoformat(),
+                'language': self.language, 'user_id': self.user_id,
+                'username': self.author.username,
+                'avatar_digest': self.author.avatar_digest}
+
+    @classmethod
+    def from_search_hit(cls, id, source):
+        try:
+            return SearchHit(
+                id=id, body=source['body'], language=source['language'],
+                timestamp=datetime.fromisoformat(source['timestamp']),
+                author=AuthorHit(id=source['user_id'],
+                                 username=source['username'],
+                                 avatar_digest=source['avatar_digest']))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+class SearchHit:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class AuthorHit(SearchHit):
+    def avatar(self, size):
+        return gravatar(self.avatar_digest, size)
+
+
+add_full_text_index(Post.__table__, Post.__searchable__)
+
+
+@sa.event.listens_for(Post, 'after_insert')
+def fan_out_post(mapper, connection, post):
+    timestamp = sa.literal(post.timestamp, sa.DateTime)
+    connection.execute(timeline_entry.insert().values(
+        user_id=post.user_id, post_id=post.id, timestamp=post.timestamp))
+    connection.execute(timeline_entry.insert().from_select(
+        ['user_id', 'post_id', 'timestamp'],
+        sa.select(followers.c.follower_id, sa.literal(post.id), timestamp)
+        .where(followers.c.followed_id == post.user_id)))
+    trim_timelines(connection, sa.or_(
+        User.id == post.user_id,
+        User.id.in_(sa.select(followers.c.follower_id).where(
+            followers.c.followed_id == post.user_id))))
+
+
+def trim_timelines(connection, users):
+    # keep the newest TIMELINE_LENGTH entries of each selected timeline
+    entry = timeline_entry.alias()
+    cutoff = (
+        sa.select(entry.c.timestamp)
+        .where(entry.c.user_id == User.id)
+        .order_by(entry.c.timestamp.desc())
+        .offset(current_app.config['TIMELINE_LENGTH'] - 1)
+        .limit(1)
+        .scalar_subquery()
+    )
+    cutoffs = [{'id': id, 'cutoff': timestamp} for id, timestamp in
+               connection.execute(sa.select(User.id, cutoff).where(users))
+               if timestamp is not None]
+    if cutoffs:
+        connection.execute(timeline_entry.delete().where(
+            timeline_entry.c.user_id == sa.bindparam('id'),
+            timeline_entry.c.timestamp < sa.bindparam('cutoff')), cutoffs)
+
+
+@sa.event.listens_for(Post, 'after_insert')
+def increment_posts_count(mapper, connection, post):
+    connection.execute(sa.update(User).where(User.id == post.user_id).values(
+        num_posts=User.num_posts + 1))
+    so.object_session(post).info.setdefault('posts_counted', set()).add(
+        post.user_id)
+
+
+@sa.event.listens_for(Post, 'after_delete')
+def decrement_posts_count(mapper, connection, post):
+    connection.execute(sa.update(User).where(User.id == post.user_id).values(
+        num_posts=User.num_posts - 1))
+    so.object_session(post).info.setdefault('posts_counted', set()).add(
+        post.user_id)
+
+
+def expire_posts_counts(session, flush_context):
+    # the counters were updated behind the ORM's back, so reload them
+    for user_id in session.info.pop('posts_counted', ()):
+        user = session.identity_map.get(
+            sa.inspect(User).identity_key_from_primary_key([user_id]))
+        if user is not None:
+            session.expire(user, ['num_posts'])
+
+
+db.event.listen(db.session, 'after_flush_postexec', expire_posts_counts)
+
+
+@sa.event.listens_for(Post, 'before_delete')
+def remove_post_from_timelines(mapper, connection, post):
+    connection.execute(timeline_entry.delete().where(
+        timeline_entry.c.post_id == post.id))
+
 
 class Message(db.Model):
+    __table_args__ = (
+        sa.Index('ix_message_recipient_id_timestamp', 'recipient_id',
+                 'timestamp'),
+    )
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     sender_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
                                                  index=True)
-    recipient_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
-                                                    index=True)
+    recipient_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
     body: so.Mapped[str] = so.mapped_column(sa.String(140))
     timestamp: so.Mapped[datetime] = so.mapped_column(
         index=True, default=lambda: datetime.now(timezone.utc))
 
     author: so.Mapped[User] = so.relationship(
         foreign_keys='Message.sender_id',
-        back_populates='messages_sent')
+        back_populates='messages_sent', lazy='selectin')
     recipient: so.Mapped[User] = so.relationship(
         foreign_keys='Message.recipient_id',
         back_populates='messages_received')
@@ -322,10 +748,14 @@ class Message(db.Model):
 
 
 class Notification(db.Model):
+    __table_args__ = (
+        sa.Index('ix_notification_user_id_name', 'user_id', 'name'),
+        sa.Index('ix_notification_user_id_timestamp', 'user_id',
+                 'timestamp'),
+    )
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     name: so.Mapped[str] = so.mapped_column(sa.String(128), index=True)
-    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
-                                               index=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
     timestamp: so.Mapped[float] = so.mapped_column(index=True, default=time)
     payload_json: so.Mapped[str] = so.mapped_column(sa.Text)
 
@@ -334,8 +764,32 @@ class Notification(db.Model):
     def get_data(self):
         return json.loads(str(self.payload_json))
 
+    @staticmethod
+    def channel(user_id):
+        return f'notifications:{user_id}'
+
+    @classmethod
+    def after_commit(cls, session):
+        for user_id, notification in session.info.pop('notifications', []):
+            try:
+                current_app.redis.publish(cls.channel(user_id),
+                                          json.dumps(notification))
+            except redis.exceptions.RedisError:
+                pass
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop('notifications', None)
+
+
+db.event.listen(db.session, 'after_commit', Notification.after_commit)
+db.event.listen(db.session, 'after_rollback', Notification.after_rollback)
+
 
 class Task(db.Model):
+    __table_args__ = (
+        sa.Index('ix_task_user_id_complete', 'user_id', 'complete'),
+    )
     id: so.Mapped[str] = so.mapped_column(sa.String(36), primary_key=True)
     name: so.Mapped[str] = so.mapped_column(sa.String(128), index=True)
     description: so.Mapped[Optional[str]] = so.mapped_column(sa.String(128))
@@ -354,3 +808,112 @@ class Task(db.Model):
     def get_progress(self):
         job = self.get_rq_job()
         return job.meta.get('progress', 0) if job is not None else 100
+
+
+class SearchOutbox(db.Model):
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    index_name: so.Mapped[str] = so.mapped_column(sa.String(64))
+    object_id: so.Mapped[int]
+    operation: so.Mapped[str] = so.mapped_column(sa.String(8))
+    timestamp: so.Mapped[float] = so.mapped_column(default=time)
+    attempts: so.Mapped[int] = so.mapped_column(default=0)
+
+    @staticmethod
+    def schedule(delay=None):
+        # a drain that has not started yet covers every commit before it,
+        # so a busy site queues one job instead of one per commit
+        key = 'search:outbox:retry' if delay else 'search:outbox:scheduled'
+        try:
+            if not current_app.redis.set(key, 1, nx=True, ex=delay or 300):
+                return
+            if delay:
+                current_app.task_queue.enqueue_in(
+                    timedelta(seconds=delay),
+                    'app.tasks.process_search_outbox')
+            else:
+                current_app.task_queue.enqueue(
+                    'app.tasks.process_search_outbox',
+                    retry=rq.Retry(max=3, interval=[10, 30, 60]))
+        except redis.exceptions.RedisError:
+            pass
+
+    @classmethod
+    def process(cls):
+        models = {model.__tablename__: model
+                  for model in SearchableMixin.searchable_models()}
+        try:
+            current_app.redis.delete('search:outbox:scheduled')
+        except redis.exceptions.RedisError:
+            pass
+        max_attempts = current_app.config['SEARCH_OUTBOX_MAX_ATTEMPTS']
+        status = {index: rebuild_status(index) for index in models}
+        paused = {index for index, (running, _) in status.items() if running}
+        processed = 0
+        retries = []
+        last_id = 0
+        while True:
+            entries = db.session.scalars(
+                sa.select(cls)
+                .where(cls.id > last_id, cls.attempts < max_attempts)
+                .order_by(cls.id)
+                .limit(current_app.config['SEARCH_OUTBOX_BATCH_SIZE'])
+                .with_for_update(skip_locked=True)).all()
+            if not entries:
+                break
+            last_id = entries[-1].id
+            entries = [entry for entry in entries
+                       if entry.index_name not in paused]
+            operations = {}
+            for entry in entries:
+                operations.setdefault(entry.index_name, {})[
+                    entry.object_id] = entry.operation
+            failed = set()
+            for index, index_operations in operations.items():
+                model = models[index]
+                objs = db.session.scalars(sa.select(model).where(
+                    model.id.in_([id for id, operation in
+                                  index_operations.items()
+                                  if operation == 'index']))).all()
+                found_ids = {obj.id for obj in objs}
+                deleted_ids = [id for id in index_operations
+                               if id not in found_ids]
+                failed.update((index, id) for id in current_app.search.update(
+                    model, objs, deleted_ids))
+                unfinished = status[index][1]
+                if unfinished:
+                    # an interrupted rebuild that is resumed later must not
+                    # miss these changes
+                    failed.update(
+                        (index, id) for id in current_app.search.update(
+                            model, objs, deleted_ids, index=unfinished))
+            for entry in entries:
+                if (entry.index_name, entry.object_id) in failed:
+                    entry.attempts += 1
+                    if entry.attempts < max_attempts:
+                        retries.append(entry.attempts)
+            db.session.execute(sa.delete(cls).where(cls.id.in_(
+                [entry.id for entry in entries
+                 if (entry.index_name, entry.object_id) not in failed])))
+            db.session.commit()
+            bump_index_generation(*operations)
+            processed += len(entries)
+        if retries:
+            # back off from the retry delay, doubling it with each attempt
+            cls.schedule(delay=current_app.config[
+                'SEARCH_OUTBOX_RETRY_DELAY'] * 2 ** (min(retries) - 1))
+        return processed
+
+
+@sa.event.listens_for(User, 'after_update')
+def reindex_user_posts(mapper, connection, user):
+    state = sa.inspect(user)
+    if not current_app.search.uses_outbox or not (
+            state.attrs.username.history.has_changes() or
+            state.attrs.email.history.has_changes()):
+        return
+    connection.execute(SearchOutbox.__table__.insert().from_select(
+        ['index_name', 'object_id', 'operation', 'timestamp', 'attempts'],
+        sa.select(sa.literal(Post.__tablename__), Post.id,
+                  sa.literal('index'), sa.literal(time()), sa.literal(0))
+        .where(Post.user_id == user.id)))
+    state.session.info['search_outbox'] = True
@@ -0,0 +1,108 @@
+import base64
+from datetime import datetime
+import json
+import sqlalchemy as sa
+from app import db
+
+
+class CursorPagination:
+    def __init__(self, items, next_cursor, prev_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(data):
+    payload = json.dumps(data, separators=(',', ':'), default=_encode_value)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode(
+        'ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Cannot encode {value!r} in a cursor')
+
+
+def _valid_value(value, python_type):
+    # cursors come from the client, so only accept the column's own type
+    if isinstance(value, bool) and python_type is not bool:
+        return False
+    if python_type is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, python_type)
+
+
+def _decode_key(cursor, columns):
+    data = decode_cursor(cursor) if cursor else None
+    if not isinstance(data, list) or len(data) != len(columns) + 1 or \
+            data[0] not in ('next', 'prev'):
+        return None, None
+    values = []
+    for column, value in zip(columns, data[1:]):
+        if isinstance(column.type, sa.DateTime):
+            try:
+                value = datetime.fromisoformat(value)
+            except (ValueError, TypeError):
+                return None, None
+        elif not _valid_value(value, column.type.python_type):
+            return None, None
+        values.append(value)
+    return data[0], values
+
+
+def _after(columns, values, descending):
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [c == v for c, v in zip(columns[:i], values[:i])]
+        if descending:
+            clauses.append(sa.and_(*equal, column < values[i]))
+        else:
+            clauses.append(sa.and_(*equal, column > values[i]))
+    return sa.or_(*clauses)
+
+
+def cursor_paginate(query, columns, cursor=None, per_page=20,
+                    descending=True):
+    direction, values = _decode_key(cursor, columns)
+    backwards = direction == 'prev'
+    reverse = descending != backwards
+    page_query = query.order_by(None).order_by(
+        *[c.desc() if reverse else c.asc() for c in columns])
+    if values is not None:
+        page_query = page_query.where(_after(columns, values, reverse))
+    items = db.session.scalars(page_query.limit(per_page + 1)).all()
+    more = len(items) > per_page
+    items = items[:per_page]
+    if backwards:
+        if not more:
+            # the start of the list was reached, so show a full first page
+            return cursor_paginate(query, columns, None, per_page, descending)
+        items.reverse()
+    has_next = more if not backwards else True
+    has_prev = values is not None if not backwards else True
+
+    def key(item):
+        return [getattr(item, c.key) for c in columns]
+
+    next_cursor = encode_cursor(['next'] + key(items[-1])) \
+        if has_next and items else None
+    prev_cursor = encode_cursor(['prev'] + key(items[0])) \
+        if has_prev and items else None
+    return CursorPagination(items, next_cursor, prev_cursor)
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import hashlib
+import hmac
+from threading import Lock
+from time import monotonic
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHasher:
+    def __init__(self, secret_key, method='scrypt', workers=2, timeout=5,
+                 cache_size=1024, cache_ttl=60):
+        self.secret_key = secret_key.encode('utf-8')
+        # werkzeug fills in the default parameters, e.g. scrypt:32768:8:1
+        self.method = generate_password_hash('', method).split('$', 1)[0]
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='passwords')
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # verified credentials are only cached in memory, never in Redis
+        self.verified = OrderedDict()
+        self.lock = Lock()
+
+    def hash(self, password):
+        return generate_password_hash(password, self.method)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
+
+    def verify(self, username, password_hash, password):
+        key = hmac.new(self.secret_key, '\0'.join(
+            (username, password, password_hash)).encode('utf-8'),
+            hashlib.sha256).digest()
+        now = monotonic()
+        with self.lock:
+            expiry = self.verified.get(key)
+            if expiry is not None:
+                if expiry > now:
+                    self.verified.move_to_end(key)
+                    return True
+                del self.verified[key]
+        future = self.executor.submit(check_password_hash, password_hash,
+                                      password)
+        try:
+            valid = future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            current_app.logger.warning(
+                'Password check for %s timed out', username)
+            return False
+        if valid:
+            with self.lock:
+                self.verified[key] = now + self.cache_ttl
+                while len(self.verified) > self.cache_size:
+                    self.verified.popitem(last=False)
+        return valid
@@ -0,0 +1,49 @@
+from time import perf_counter
+from flask import current_app, g, has_app_context, has_request_context, \
+    request
+import sqlalchemy as sa
+from app import db
+
+
+class QueryStats:
+    def __init__(self, app):
+        with app.app_context():
+            engine = db.engine
+        sa.event.listen(engine, 'before_cursor_execute', self.before_execute)
+        sa.event.listen(engine, 'after_cursor_execute', self.after_execute)
+        app.before_request(self.start_request)
+        app.after_request(self.add_headers)
+
+    @staticmethod
+    def start_request():
+        g.db_query_count = 0
+        g.db_query_time = 0.0
+
+    @staticmethod
+    def before_execute(conn, cursor, statement, parameters, context,
+                       executemany):
+        context.query_start = perf_counter()
+
+    @staticmethod
+    def after_execute(conn, cursor, statement, parameters, context,
+                      executemany):
+        elapsed = perf_counter() - context.query_start
+        if not has_app_context():
+            return
+        if has_request_context() and 'db_query_count' in g:
+            g.db_query_count += 1
+            g.db_query_time += elapsed
+        threshold = current_app.config['SLOW_QUERY_THRESHOLD']
+        if threshold is not None and elapsed >= threshold:
+            current_app.logger.warning(
+                'Slow query (%.3fs) in %s: %s', elapsed,
+                request.endpoint if has_request_context() else None,
+                statement)
+
+    @staticmethod
+    def add_headers(response):
+        if current_app.debug and 'db_query_count' in g:
+            response.headers['X-DB-Query-Count'] = str(g.db_query_count)
+            response.headers['X-DB-Query-Time'] = '{:.3f}'.format(
+                g.db_query_time * 1000)
+        return response
@@ -1,28 +1,573 @@
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from hashlib import sha256
+import heapq
+import json
+import math
+import re
+from threading import Lock
+from elasticsearch import NotFoundError
+from elasticsearch.helpers import bulk
 from flask import current_app
+import redis
+import sqlalchemy as sa
+from app import db
+from app.pagination import CursorPagination, decode_cursor, encode_cursor
 
 
-def add_to_index(index, model):
-    if not current_app.elasticsearch:
-        return
+def document(model, stored=False):
     payload = {}
     for field in model.__searchable__:
         payload[field] = getattr(model, field)
-    current_app.elasticsearch.index(index=index, id=model.id, document=payload)
+    if stored:
+        payload.update(model.stored_search_fields())
+    return payload
 
 
-def remove_from_index(index, model):
-    if not current_app.elasticsearch:
-        return
-    current_app.elasticsearch.delete(index=index, id=model.id)
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
 
 
-def query_index(index, query, page, per_page):
-    if not current_app.elasticsearch:
-        return [], 0
-    search = current_app.elasticsearch.search(
-        index=index,
-        query={'multi_match': {'query': query, 'fields': ['*']}},
-        from_=(page - 1) * per_page,
-        size=per_page)
-    ids = [int(hit['_id']) for hit in search['hits']['hits']]
-    return ids, search['hits']['total']['value']
+def _generation_key(index):
+    return f'search:generation:{index}'
+
+
+def index_generation(index):
+    try:
+        return int(current_app.redis.get(_generation_key(index)) or 0)
+    except redis.exceptions.RedisError:
+        return None
+
+
+def bump_index_generation(*indexes):
+    try:
+        for index in indexes:
+            current_app.redis.incr(_generation_key(index))
+    except redis.exceptions.RedisError:
+        pass
+
+
+def _cached(model, expression, position, query):
+    index = model.__tablename__
+    generation = index_generation(index)
+    if generation is None:
+        # without a generation the cached results could not be invalidated
+        return query()
+    normalized = ' '.join(expression.lower().split())
+    key = '{}:{}:{}'.format(index, generation, sha256('{}\n{}'.format(
+        normalized, position).encode('utf-8')).hexdigest())
+    cached = current_app.search_cache.get(key)
+    if cached is not None:
+        return cached
+    result = list(query())
+    current_app.search_cache.set(key, result)
+    return result
+
+
+def cached_query_hits(model, expression, page, per_page):
+    hits, total = _cached(
+        model, expression, f'page:{page}:{per_page}',
+        lambda: current_app.search.query_hits(model, expression, page,
+                                              per_page))
+    return [tuple(hit) for hit in hits], total
+
+
+def cached_query_page(model, expression, cursor, per_page):
+    def query():
+        page, total = current_app.search.query_page(model, expression, cursor,
+                                                    per_page)
+        return page.items, total, page.next_cursor, page.prev_cursor
+
+    hits, total, next_cursor, prev_cursor = _cached(
+        model, expression, f'cursor:{cursor or ""}:{per_page}', query)
+    return CursorPagination([tuple(hit) for hit in hits], next_cursor,
+                            prev_cursor), total
+
+
+def _valid_offset_cursor(data):
+    return isinstance(data, list) and len(data) == 2 and \
+        data[0] == 'from' and type(data[1]) is int and data[1] > 0
+
+
+def _valid_pit_cursor(data):
+    # cursors come from the client, only pass plain sort values to ES
+    return isinstance(data, list) and len(data) == 3 and \
+        data[0] in ('next', 'prev') and isinstance(data[1], str) and \
+        isinstance(data[2], list) and len(data[2]) == 2 and \
+        all(type(value) in (int, float, str) for value in data[2])
+
+
+class SearchBackend(ABC):
+    def __init__(self, app):
+        self.app = app
+
+    @property
+    def uses_outbox(self):
+        return False
+
+    @property
+    def tracks_changes(self):
+        return False
+
+    @abstractmethod
+    def query(self, model, expression, page, per_page):
+        pass
+
+    def query_hits(self, model, expression, page, per_page):
+        ids, total = self.query(model, expression, page, per_page)
+        return [(id, None) for id in ids], total
+
+    def query_page(self, model, expression, cursor, per_page):
+        data = decode_cursor(cursor) if cursor else None
+        page = data[1] if isinstance(data, list) and len(data) == 2 and \
+            data[0] == 'page' and isinstance(data[1], int) and \
+            data[1] > 0 else 1
+        hits, total = self.query_hits(model, expression, page, per_page)
+        next_cursor = encode_cursor(['page', page + 1]) \
+            if total > page * per_page else None
+        prev_cursor = encode_cursor(['page', page - 1]) if page > 1 else None
+        return CursorPagination(hits, next_cursor, prev_cursor), total
+
+    def update(self, model, objs, deleted_ids, index=None):
+        return []
+
+    def apply(self, changes):
+        pass
+
+
+class ElasticsearchBackend(SearchBackend):
+    @property
+    def uses_outbox(self):
+        return self.app.elasticsearch is not None
+
+    def query(self, model, expression, page, per_page):
+        hits, total = self.query_hits(model, expression, page, per_page)
+        return [id for id, source in hits], total
+
+    def query_hits(self, model, expression, page, per_page):
+        if not self.app.elasticsearch:
+            return [], 0
+        search = self.app.elasticsearch.search(
+            index=model.__tablename__,
+            query={'multi_match': {'query': expression,
+                                   'fields': model.__searchable__}},
+            from_=(page - 1) * per_page,
+            size=per_page)
+        hits = [(int(hit['_id']), hit.get('_source'))
+                for hit in search['hits']['hits']]
+        return hits, search['hits']['total']['value']
+
+    def query_page(self, model, expression, cursor, per_page):
+        es = self.app.elasticsearch
+        if not es:
+            return CursorPagination([], None, None), 0
+        data = decode_cursor(cursor) if cursor else None
+        if _valid_offset_cursor(data):
+            direction, pit_id, after, offset = 'next', None, None, data[1]
+        elif _valid_pit_cursor(data):
+            (direction, pit_id, after), offset = data, 0
+        else:
+            # most searches stop at the first page, so it runs without a
+            # point in time
+            hits, total = self.query_hits(model, expression, 1, per_page + 1)
+            next_cursor = encode_cursor(['from', per_page]) \
+                if len(hits) > per_page else None
+            return CursorPagination(hits[:per_page], next_cursor, None), total
+        backwards = direction == 'prev'
+        # ties in score are broken in index order, as in the plain search
+        # that returned the first page
+        sort = [{'_score': 'asc'}, {'_shard_doc': 'desc'}] if backwards \
+            else [{'_score': 'desc'}, {'_shard_doc': 'asc'}]
+        keep_alive = self.app.config['SEARCH_PIT_KEEP_ALIVE']
+
+        def search(pit_id):
+            return es.search(
+                pit={'id': pit_id, 'keep_alive': keep_alive},
+                query={'multi_match': {'query': expression,
+                                       'fields': model.__searchable__}},
+                sort=sort,
+                search_after=after, from_=offset, size=per_page + 1)
+
+        result = None
+        if pit_id is not None:
+            try:
+                result = search(pit_id)
+            except NotFoundError:
+                # the point in time expired, continue in a new one
+                pass
+        if result is None:
+            pit_id = es.open_point_in_time(index=model.__tablename__,
+                                           keep_alive=keep_alive)['id']
+            result = search(pit_id)
+        pit_id = result.get('pit_id', pit_id)
+        hits = result['hits']['hits']
+        more = len(hits) > per_page
+        hits = hits[:per_page]
+        if not more:
+            # an end of the results was reached, a new point in time is
+            # opened if the user pages back into them
+            self.close_point_in_time(pit_id)
+        if backwards:
+            if not more:
+                # the start of the results was reached, show the first page
+                return self.query_page(model, expression, None, per_page)
+            hits.reverse()
+        # pages read through a point in time always follow the first one
+        has_next = more if not backwards else True
+        next_cursor = encode_cursor(['next', pit_id, hits[-1]['sort']]) \
+            if has_next and hits else None
+        prev_cursor = encode_cursor(['prev', pit_id, hits[0]['sort']]) \
+            if hits else None
+        return CursorPagination(
+            [(int(hit['_id']), hit.get('_source')) for hit in hits],
+            next_cursor, prev_cursor), result['hits']['total']['value']
+
+    def close_point_in_time(self, pit_id):
+        try:
+            self.app.elasticsearch.close_point_in_time(id=pit_id)
+        except NotFoundError:
+            pass
+
+    def update(self, model, objs, deleted_ids, index=None):
+        if not self.app.elasticsearch:
+            return []
+        index = index or model.__tablename__
+        actions = [{'_op_type': 'index', '_index': index, '_id': obj.id,
+                    '_source': document(obj, stored=True)} for obj in objs]
+        actions += [{'_op_type': 'delete', '_index': index, '_id': id}
+                    for id in deleted_ids]
+        _, errors = bulk(self.app.elasticsearch, actions,
+                         raise_on_error=False)
+        failed_ids = []
+        for error in errors:
+            result = next(iter(error.values()))
+            if result.get('status') != 404:
+                failed_ids.append(int(result['_id']))
+        return failed_ids
+
+
+class DatabaseBackend(SearchBackend):
+    def query(self, model, expression, page, per_page):
+        terms = tokenize(expression)
+        if not terms:
+            return [], 0
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            return self._query_sqlite(model, terms, page, per_page)
+        if dialect == 'postgresql':
+            return self._query_postgresql(model, terms, page, per_page)
+        return self._query_like(model, terms, page, per_page)
+
+    def _query_sqlite(self, model, terms, page, per_page):
+        fts = f'{model.__tablename__}_fts'
+        match = ' OR '.join(f'"{term}"' for term in terms)
+        total = db.session.scalar(sa.text(
+            f'SELECT count(*) FROM {fts} WHERE {fts} MATCH :match'),
+            {'match': match})
+        ids = db.session.scalars(sa.text(
+            f'SELECT rowid FROM {fts} WHERE {fts} MATCH :match '
+            'ORDER BY rank LIMIT :limit OFFSET :offset'),
+            {'match': match, 'limit': per_page,
+             'offset': (page - 1) * per_page}).all()
+        return ids, total
+
+    def _query_postgresql(self, model, terms, page, per_page):
+        config = sa.literal_column("'simple'")
+        vector = sa.func.to_tsvector(config, _document_expression(model))
+        tsquery = sa.func.to_tsquery(config, ' | '.join(terms))
+        condition = vector.op('@@')(tsquery)
+        total = db.session.scalar(
+            sa.select(sa.func.count(model.id)).where(condition))
+        ids = db.session.scalars(
+            sa.select(model.id).where(condition)
+            .order_by(sa.func.ts_rank(vector, tsquery).desc(),
+                      model.id.desc())
+            .limit(per_page).offset((page - 1) * per_page)).all()
+        return ids, total
+
+    def _query_like(self, model, terms, page, per_page):
+        condition = sa.or_(*[getattr(model, field).ilike(f'%{term}%')
+                             for field in model.__searchable__
+                             for term in terms])
+        total = db.session.scalar(
+            sa.select(sa.func.count(model.id)).where(condition))
+        ids = db.session.scalars(
+            sa.select(model.id).where(condition).order_by(model.id.desc())
+            .limit(per_page).offset((page - 1) * per_page)).all()
+        return ids, total
+
+
+class InvertedIndex:
+    def __init__(self):
+        # term -> (sorted ids, term frequencies)
+        self.postings = {}
+        # id -> (number of terms, distinct terms)
+        self.documents = {}
+
+    def add(self, id, text):
+        self.remove(id)
+        terms = tokenize(text)
+        counts = Counter(terms)
+        for term, count in counts.items():
+            ids, frequencies = self.postings.setdefault(
+                term, (array('q'), array('H')))
+            i = len(ids) if not ids or ids[-1] < id else bisect_left(ids, id)
+            ids.insert(i, id)
+            frequencies.insert(i, min(count, 65535))
+        self.documents[id] = (len(terms), tuple(counts))
+
+    def remove(self, id):
+        length, terms = self.documents.pop(id, (0, ()))
+        for term in terms:
+            ids, frequencies = self.postings[term]
+            i = bisect_left(ids, id)
+            del ids[i]
+            del frequencies[i]
+            if not ids:
+                del self.postings[term]
+
+    def search(self, terms, offset, limit):
+        scores = {}
+        for term in set(terms):
+            ids, frequencies = self.postings.get(term, ((), ()))
+            if not ids:
+                continue
+            idf = math.log(1 + len(self.documents) / len(ids))
+            for id, frequency in zip(ids, frequencies):
+                scores[id] = scores.get(id, 0.0) + \
+                    frequency / self.documents[id][0] * idf
+        ranked = heapq.nlargest(offset + limit, scores.items(),
+                                key=lambda item: (item[1], item[0]))
+        return [id for id, score in ranked[offset:]], len(scores)
+
+
+class MemoryBackend(SearchBackend):
+    def __init__(self, app):
+        super().__init__(app)
+        self.indexes = {}
+        self.lock = Lock()
+
+    @property
+    def tracks_changes(self):
+        return True
+
+    def query(self, model, expression, page, per_page):
+        terms = tokenize(expression)
+        if not terms:
+            return [], 0
+        with self.lock:
+            return self._index(model).search(terms, (page - 1) * per_page,
+                                             per_page)
+
+    def apply(self, changes):
+        with self.lock:
+            for model, id, payload in changes:
+                index = self.indexes.get(model.__tablename__)
+                if index is None:
+                    # built from the database on first use
+                    continue
+                if payload is None:
+                    index.remove(id)
+                else:
+                    index.add(id, _document_text(payload.values()))
+
+    def clear(self):
+        with self.lock:
+            self.indexes.clear()
+
+    def _index(self, model):
+        index = self.indexes.get(model.__tablename__)
+        if index is None:
+            index = InvertedIndex()
+            query = sa.select(model.id, *[getattr(model, field) for field in
+                                          model.__searchable__])
+            for id, *values in db.session.execute(
+                    query.execution_options(yield_per=1000)):
+                index.add(id, _document_text(values))
+            self.indexes[model.__tablename__] = index
+        return index
+
+
+backends = {
+    'elasticsearch': ElasticsearchBackend,
+    'database': DatabaseBackend,
+    'memory': MemoryBackend,
+}
+
+
+def _document_text(values):
+    return ' '.join(str(value) for value in values if value is not None)
+
+
+def _document_expression(model):
+    columns = [getattr(model, field) for field in model.__searchable__]
+    if len(columns) == 1:
+        return columns[0]
+    expression = sa.func.coalesce(columns[0], '')
+    for column in columns[1:]:
+        expression = expression + ' ' + sa.func.coalesce(column, '')
+    return expression
+
+
+def full_text_ddl(table, fields):
+    fts = f'{table}_fts'
+    columns = ', '.join(fields)
+    new = ', '.join(f'new.{field}' for field in fields)
+    old = ', '.join(f'old.{field}' for field in fields)
+    document = fields[0] if len(fields) == 1 else \
+        " || ' ' || ".join(f"coalesce({field}, '')" for field in fields)
+    return {
+        'sqlite': {
+            'after_create': [
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({columns}, "
+                f"content='{table}', content_rowid='id')",
+                f'CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); '
+                'END',
+                f'CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {columns}) "
+                f"VALUES ('delete', old.id, {old}); END",
+                f'CREATE TRIGGER {fts}_update AFTER UPDATE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {columns}) "
+                f"VALUES ('delete', old.id, {old}); "
+                f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); '
+                'END',
+            ],
+            'before_drop': [f'DROP TABLE IF EXISTS {fts}'],
+        },
+        'postgresql': {
+            'after_create': [
+                f'CREATE INDEX ix_{fts} ON {table} USING gin '
+                f"(to_tsvector('simple', {document}))",
+            ],
+        },
+    }
+
+
+def add_full_text_index(table, fields):
+    for dialect, events in full_text_ddl(table.name, fields).items():
+        for event, statements in events.items():
+            for statement in statements:
+                sa.event.listen(table, event, sa.DDL(statement).execute_if(
+                    dialect=dialect))
+
+
+class RebuildInProgress(RuntimeError):
+    pass
+
+
+def _checkpoint_key(alias):
+    return f'search:reindex:{alias}'
+
+
+def _running_key(alias):
+    return f'search:reindex:{alias}:running'
+
+
+def rebuild_status(alias):
+    # whether a rebuild is running, and the index of an unfinished one
+    try:
+        pipeline = current_app.redis.pipeline(transaction=False)
+        pipeline.exists(_running_key(alias))
+        pipeline.get(_checkpoint_key(alias))
+        running, checkpoint = pipeline.execute()
+    except redis.exceptions.RedisError:
+        return False, None
+    return bool(running), checkpoint and json.loads(checkpoint)['index']
+
+
+def rebuild_index(model, workers=4, batch_size=500, resume=False,
+                  keep_old=False, progress=None):
+    alias = model.__tablename__
+    # the marker expires unless completed chunks keep refreshing it, so a
+    # rebuild that dies does not pause the outbox for good
+    ttl = current_app.config['SEARCH_REINDEX_MARKER_TTL']
+    if not current_app.redis.set(_running_key(alias), 1, nx=True, ex=ttl):
+        raise RebuildInProgress(f'A rebuild of {alias} is already running.')
+    try:
+        return _rebuild_index(model, workers, batch_size, resume, keep_old,
+                              progress)
+    finally:
+        current_app.redis.delete(_running_key(alias))
+
+
+def _rebuild_index(model, workers, batch_size, resume, keep_old, progress):
+    es = current_app.elasticsearch
+    alias = model.__tablename__
+    ttl = current_app.config['SEARCH_REINDEX_MARKER_TTL']
+    checkpoint = current_app.redis.get(_checkpoint_key(alias))
+    checkpoint = json.loads(checkpoint) if checkpoint else None
+    if checkpoint and not resume:
+        # start over, dropping the index of the unfinished rebuild unless
+        # it was already swapped in
+        if not es.indices.exists_alias(name=alias) or checkpoint['index'] \
+                not in es.indices.get_alias(name=alias):
+            es.indices.delete(index=checkpoint['index'],
+                              ignore_unavailable=True)
+        checkpoint = None
+    if checkpoint is None:
+        checkpoint = {'index': '{}-{}'.format(alias, datetime.now(
+            timezone.utc).strftime('%Y%m%d%H%M%S')), 'last_id': 0}
+        es.indices.create(index=checkpoint['index'])
+        current_app.redis.set(_checkpoint_key(alias), json.dumps(checkpoint))
+    index = checkpoint['index']
+    total = db.session.scalar(sa.select(sa.func.count(model.id)).where(
+        model.id > checkpoint['last_id']))
+    done = 0
+    pending = deque()
+
+    def complete_chunk():
+        nonlocal done
+        last_id, count, future = pending.popleft()
+        future.result()
+        checkpoint['last_id'] = last_id
+        pipeline = current_app.redis.pipeline()
+        pipeline.set(_checkpoint_key(alias), json.dumps(checkpoint))
+        pipeline.expire(_running_key(alias), ttl)
+        pipeline.execute()
+        done += count
+        if progress:
+            progress(done, total)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        last_id = checkpoint['last_id']
+        while True:
+            objs = db.session.scalars(
+                sa.select(model).where(model.id > last_id)
+                .order_by(model.id).limit(batch_size)).all()
+            if not objs:
+                break
+            last_id = objs[-1].id
+            actions = [{'_index': index, '_id': obj.id,
+                        '_source': document(obj, stored=True)}
+                       for obj in objs]
+            pending.append((last_id, len(objs),
+                            executor.submit(bulk, es, actions)))
+            while len(pending) >= 2 * workers or \
+                    (pending and pending[0][2].done()):
+                complete_chunk()
+        while pending:
+            complete_chunk()
+
+    es.indices.refresh(index=index)
+    actions = [{'add': {'index': index, 'alias': alias}}]
+    old_indexes = []
+    if es.indices.exists_alias(name=alias):
+        old_indexes = [name for name in es.indices.get_alias(name=alias)
+                       if name != index]
+        actions += [{'remove': {'index': name, 'alias': alias}}
+                    for name in old_indexes]
+    elif es.indices.exists(index=alias):
+        # a concrete index created before aliases were used
+        actions.append({'remove_index': {'index': alias}})
+    es.indices.update_aliases(actions=actions)
+    if not keep_old:
+        for name in old_indexes:
+            es.indices.delete(index=name)
+    current_app.redis.delete(_checkpoint_key(alias))
+    bump_index_generation(alias)
+    return index
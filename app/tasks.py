@@ -1,12 +1,16 @@
+import gzip
 import json
 import sys
+import tempfile
 import time
-import sqlalchemy as sa
 from flask import render_template
 from rq import get_current_job
+import sqlalchemy as sa
 from app import create_app, db
-from app.models import User, Post, Task
+from app.models import User, Post, Task, SearchOutbox
 from app.email import send_email
+from app.exports import export_format, store_export
+from app.pagination import cursor_paginate
 
 app = create_app()
 app.app_context().push()
@@ -25,32 +29,95 @@ def _set_task_progress(progress):
         db.session.commit()
 
 
-def export_posts(user_id):
+class ProgressReporter:
+    def __init__(self, step=None, interval=None):
+        self.step = step if step is not None else \
+            app.config['TASK_PROGRESS_STEP']
+        self.interval = interval if interval is not None else \
+            app.config['TASK_PROGRESS_INTERVAL']
+        self.reported = None
+        self.reported_at = 0
+        self.finished = False
+
+    def update(self, progress):
+        progress = min(progress, 99)
+        if self.finished or progress == self.reported:
+            return
+        if self.reported is None or progress - self.reported >= self.step or \
+                time.monotonic() - self.reported_at >= self.interval:
+            self._report(progress)
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            self._report(100)
+
+    def _report(self, progress):
+        _set_task_progress(progress)
+        self.reported = progress
+        self.reported_at = time.monotonic()
+
+
+def export_posts(user_id, download_url):
+    progress = ProgressReporter()
     try:
         user = db.session.get(User, user_id)
-        _set_task_progress(0)
-        data = []
-        i = 0
-        total_posts = db.session.scalar(sa.select(sa.func.count()).select_from(
-            user.posts.select().subquery()))
-        for post in db.session.scalars(user.posts.select().order_by(
-                Post.timestamp.asc())):
-            data.append({'body': post.body,
-                         'timestamp': post.timestamp.isoformat() + 'Z'})
-            time.sleep(5)
-            i += 1
-            _set_task_progress(100 * i // total_posts)
-
+        progress.update(0)
+        total_posts = user.posts_count()
+        exported_posts = 0
+        filename, content_type = export_format()
+        # scratch space on the worker, the finished export goes to Redis
+        with tempfile.TemporaryFile() as archive:
+            if content_type == 'application/gzip':
+                output = gzip.GzipFile(fileobj=archive, mode='wb')
+            else:
+                output = archive
+            output.write(b'{"posts": [')
+            query = user.posts.select()
+            cursor = None
+            while True:
+                posts = cursor_paginate(
+                    query, (Post.timestamp, Post.id), cursor,
+                    app.config['EXPORT_POSTS_CHUNK_SIZE'], descending=False)
+                for post in posts.items:
+                    output.write(b',\n    ' if exported_posts
+                                 else b'\n    ')
+                    output.write(json.dumps({
+                        'body': post.body,
+                        'timestamp': post.timestamp.isoformat() + 'Z'
+                    }).encode('utf-8'))
+                    exported_posts += 1
+                    # the counter is denormalized and may lag behind
+                    if total_posts:
+                        progress.update(100 * exported_posts // total_posts)
+                if not posts.has_next:
+                    break
+                cursor = posts.next_cursor
+            output.write(b'\n]}\n')
+            if output is not archive:
+                output.close()
+            archive.seek(0)
+            store_export(user_id, archive)
         send_email(
             '[Microblog] Your blog posts',
             sender=app.config['ADMINS'][0], recipients=[user.email],
-            text_body=render_template('email/export_posts.txt', user=user),
-            html_body=render_template('email/export_posts.html', user=user),
-            attachments=[('posts.json', 'application/json',
-                          json.dumps({'posts': data}, indent=4))],
+            text_body=render_template('email/export_posts.txt', user=user,
+                                      download_url=download_url),
+            html_body=render_template('email/export_posts.html', user=user,
+                                      download_url=download_url),
             sync=True)
     except Exception:
-        _set_task_progress(100)
         app.logger.error('Unhandled exception', exc_info=sys.exc_info())
     finally:
-        _set_task_progress(100)
+        progress.finish()
+
+
+def process_search_outbox():
+    SearchOutbox.process()
+
+
+def detect_languages(post_ids):
+    for post in db.session.scalars(sa.select(Post).where(
+            Post.id.in_(post_ids))):
+        post.language = app.language_detector.detect(post.body)
+    db.session.commit()
@@ -1,21 +1,83 @@
+from hashlib import sha256
 import requests
+from requests.adapters import HTTPAdapter
 from flask import current_app
 from flask_babel import _
 
+MAX_BATCH_ITEMS = 100
+MAX_BATCH_CHARACTERS = 10000
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 
 def translate(text, source_language, dest_language):
+    return translate_batch([{'text': text,
+                             'source_language': source_language,
+                             'dest_language': dest_language}])[0]
+
+
+def translate_batch(items):
     if 'MS_TRANSLATOR_KEY' not in current_app.config or \
             not current_app.config['MS_TRANSLATOR_KEY']:
-        return _('Error: the translation service is not configured.')
+        return [_('Error: the translation service is not configured.')] * \
+            len(items)
+    translations = [None] * len(items)
+    pending = {}
+    for i, item in enumerate(items):
+        key = '{}:{}:{}'.format(
+            sha256(item['text'].encode('utf-8')).hexdigest(),
+            item['source_language'], item['dest_language'])
+        translations[i] = current_app.translation_cache.get(key)
+        if translations[i] is None:
+            languages = (item['source_language'], item['dest_language'])
+            pending.setdefault(languages, {}).setdefault(
+                key, (item['text'], []))[1].append(i)
+    for (source_language, dest_language), texts in pending.items():
+        for chunk in _chunks(list(texts.items())):
+            results = _request_translations(
+                [text for key, (text, indexes) in chunk],
+                source_language, dest_language)
+            for (key, (text, indexes)), result in zip(chunk, results):
+                if result is None:
+                    result = _('Error: the translation service failed.')
+                else:
+                    current_app.translation_cache.set(key, result)
+                for i in indexes:
+                    translations[i] = result
+    return translations
+
+
+def _chunks(texts):
+    chunk = []
+    characters = 0
+    for key, (text, indexes) in texts:
+        if chunk and (len(chunk) == MAX_BATCH_ITEMS or
+                      characters + len(text) > MAX_BATCH_CHARACTERS):
+            yield chunk
+            chunk = []
+            characters = 0
+        chunk.append((key, (text, indexes)))
+        characters += len(text)
+    if chunk:
+        yield chunk
+
+
+def _request_translations(texts, source_language, dest_language):
     auth = {
         'Ocp-Apim-Subscription-Key': current_app.config['MS_TRANSLATOR_KEY'],
         'Ocp-Apim-Subscription-Region': 'westus'
     }
-    r = requests.post(
-        'https://api.cognitive.microsofttranslator.com'
-        '/translate?api-version=3.0&from={}&to={}'.format(
-            source_language, dest_language), headers=auth, json=[
-                {'Text': text}])
+    try:
+        r = session.post(
+            '{}/translate?api-version=3.0&from={}&to={}'.format(
+                current_app.config['MS_TRANSLATOR_URL'], source_language,
+                dest_language), headers=auth,
+            json=[{'Text': text} for text in texts],
+            timeout=current_app.config['MS_TRANSLATOR_TIMEOUT'])
+    except requests.RequestException:
+        return [None] * len(texts)
     if r.status_code != 200:
-        return _('Error: the translation service failed.')
-    return r.json()[0]['translations'][0]['text']
+        return [None] * len(texts)
+    return [result['translations'][0]['text'] for result in r.json()]
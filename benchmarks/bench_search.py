@@ -0,0 +1,103 @@
+"""Compare the search backends on a synthetic corpus.
+
+Usage: python benchmarks/bench_search.py [--posts N] [--queries N]
+
+The memory and database backends always run, against a temporary SQLite
+database. The Elasticsearch backend also runs when ELASTICSEARCH_URL is set,
+using a throwaway index that is deleted at the end.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from elasticsearch.helpers import bulk  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+from app import create_app, db, search  # noqa: E402
+from app.models import Post, User  # noqa: E402
+from config import Config  # noqa: E402
+
+
+def make_corpus(posts, vocabulary=5000, seed=42):
+    rng = random.Random(seed)
+    words = ['w{}'.format(i) for i in range(vocabulary)]
+    weights = [1 / (i + 1) for i in range(vocabulary)]
+    return words, weights, [' '.join(rng.choices(words, weights, k=12))
+                            for i in range(posts)]
+
+
+def make_queries(words, weights, count, seed=7):
+    rng = random.Random(seed)
+    return [' '.join(rng.choices(words, weights, k=rng.randint(1, 3)))
+            for i in range(count)]
+
+
+def timed(label, queries, run):
+    start = time.perf_counter()
+    for query in queries:
+        run(query)
+    elapsed = time.perf_counter() - start
+    print('{:<15} {:>9.1f} queries/s {:>8.3f} ms/query'.format(
+        label, len(queries) / elapsed, 1000 * elapsed / len(queries)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--per-page', type=int, default=25)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        class BenchConfig(Config):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(
+                tmp, 'bench.db')
+            SEARCH_BACKEND = 'database'
+            LOG_TO_STDOUT = True
+
+        app = create_app(BenchConfig)
+        with app.app_context():
+            db.create_all()
+            user = User(username='bench', email='bench@example.com')
+            db.session.add(user)
+            db.session.commit()
+            words, weights, bodies = make_corpus(args.posts)
+            db.session.execute(sa.insert(Post), [
+                {'body': body, 'user_id': user.id} for body in bodies])
+            db.session.commit()
+            queries = make_queries(words, weights, args.queries)
+
+            backends = [('database', search.DatabaseBackend(app))]
+            memory = search.MemoryBackend(app)
+            start = time.perf_counter()
+            memory.query(Post, 'w0', 1, 1)
+            print('memory index built in {:.2f}s'.format(
+                time.perf_counter() - start))
+            backends.append(('memory', memory))
+            for name, backend in backends:
+                timed(name, queries, lambda query: backend.query(
+                    Post, query, 1, args.per_page))
+
+            if app.elasticsearch:
+                index = 'bench-post-' + uuid.uuid4().hex
+                bulk(app.elasticsearch, ({'_index': index, '_id': id,
+                                          '_source': {'body': body}}
+                                         for id, body in enumerate(bodies)))
+                app.elasticsearch.indices.refresh(index=index)
+                try:
+                    timed('elasticsearch', queries,
+                          lambda query: app.elasticsearch.search(
+                              index=index, query={'multi_match': {
+                                  'query': query, 'fields': ['*']}},
+                              size=args.per_page))
+                finally:
+                    app.elasticsearch.indices.delete(index=index)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,8 @@ class Config:
         'postgres://', 'postgresql://') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
+    SLOW_QUERY_THRESHOLD = float(
+        os.environ.get('SLOW_QUERY_THRESHOLD') or 0.5)
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
@@ -20,6 +22,44 @@ class Config:
     ADMINS = ['your-email@example.com']
     LANGUAGES = ['en', 'es']
     MS_TRANSLATOR_KEY = os.environ.get('MS_TRANSLATOR_KEY')
+    MS_TRANSLATOR_URL = os.environ.get('MS_TRANSLATOR_URL') or \
+        'https://api.cognitive.microsofttranslator.com'
+    MS_TRANSLATOR_TIMEOUT = 10
+    TRANSLATION_CACHE_SIZE = 1024
+    TRANSLATION_CACHE_TTL = 7 * 24 * 3600
+    API_TOKEN_MODE = os.environ.get('API_TOKEN_MODE') or 'opaque'
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+    PASSWORD_CHECK_TIMEOUT = 5
+    PASSWORD_CACHE_SIZE = 1024
+    PASSWORD_CACHE_TTL = 60
+    TOKEN_CACHE_SIZE = 10000
+    TOKEN_CACHE_TTL = 300
+    TOKEN_CACHE_LOCAL_TTL = 10
+    LANGUAGE_DETECTION_SEED = 0
+    LANGUAGE_DETECTION_ASYNC = os.environ.get(
+        'LANGUAGE_DETECTION_ASYNC', '').lower() in ('1', 'true', 'yes')
+    LANGUAGE_CACHE_SIZE = 1024
+    LANGUAGE_CACHE_TTL = 24 * 3600
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND')
+    SEARCH_CACHE_SIZE = 1024
+    SEARCH_CACHE_TTL = 30
+    SEARCH_PIT_KEEP_ALIVE = '1m'
+    SEARCH_OUTBOX_BATCH_SIZE = 500
+    SEARCH_OUTBOX_MAX_ATTEMPTS = 5
+    SEARCH_OUTBOX_RETRY_DELAY = 30
+    SEARCH_REINDEX_MARKER_TTL = 300
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379'
     POSTS_PER_PAGE = 5
+    NOTIFICATIONS_STREAM = os.environ.get('NOTIFICATIONS_STREAM') is not None
+    NOTIFICATIONS_STREAM_KEEPALIVE = 15
+    NOTIFICATIONS_STREAM_TIMEOUT = 300
+    EXPORT_POSTS_CHUNK_SIZE = 1000
+    EXPORT_POSTS_GZIP = os.environ.get('EXPORT_POSTS_GZIP') is not None
+    EXPORT_POSTS_TTL = int(os.environ.get('EXPORT_POSTS_TTL') or 24 * 3600)
+    TASK_PROGRESS_STEP = 5
+    TASK_PROGRESS_INTERVAL = 5
+    LAST_SEEN_FLUSH_INTERVAL = int(
+        os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 60)
+    TIMELINE_LENGTH = int(os.environ.get('TIMELINE_LENGTH') or 800)
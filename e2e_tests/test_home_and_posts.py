@@ -81,7 +81,7 @@ def test_pagination_links_render_when_multiple_pages(browser, live_server):
     assert "pagination_test_post" in browser.page_source
 
     next_link = browser.find_element(By.PARTIAL_LINK_TEXT, "Older posts")
-    assert "page=2" in next_link.get_attribute("href")
+    assert "cursor=" in next_link.get_attribute("href")
     prev_link = browser.find_element(By.PARTIAL_LINK_TEXT, "Newer posts")
     assert "None" in prev_link.get_attribute("href")
 
@@ -98,4 +98,4 @@ def test_pagination_links_render_when_multiple_pages(browser, live_server):
     next_link = browser.find_element(By.PARTIAL_LINK_TEXT, "Older posts")
     prev_link = browser.find_element(By.PARTIAL_LINK_TEXT, "Newer posts")
     assert "None" in next_link.get_attribute("href")
-    assert "/explore?page=1" in prev_link.get_attribute("href")
+    assert "/explore?cursor=" in prev_link.get_attribute("href")
@@ -0,0 +1,48 @@
+"""full text search
+
+Revision ID: be89a7c7c9aa
+Revises: 5d0252b2a428
+Create Date: 2026-10-18 04:13:57.578001
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'be89a7c7c9aa'
+down_revision = '5d0252b2a428'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE post_fts USING fts5(body, "
+                   "content='post', content_rowid='id')")
+        op.execute("CREATE TRIGGER post_fts_insert AFTER INSERT ON post BEGIN "
+                   "INSERT INTO post_fts(rowid, body) "
+                   "VALUES (new.id, new.body); END")
+        op.execute("CREATE TRIGGER post_fts_delete AFTER DELETE ON post BEGIN "
+                   "INSERT INTO post_fts(post_fts, rowid, body) "
+                   "VALUES ('delete', old.id, old.body); END")
+        op.execute("CREATE TRIGGER post_fts_update AFTER UPDATE ON post BEGIN "
+                   "INSERT INTO post_fts(post_fts, rowid, body) "
+                   "VALUES ('delete', old.id, old.body); "
+                   "INSERT INTO post_fts(rowid, body) "
+                   "VALUES (new.id, new.body); END")
+        op.execute("INSERT INTO post_fts(post_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        op.execute("CREATE INDEX ix_post_fts ON post USING gin "
+                   "(to_tsvector('simple', body))")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute('DROP TRIGGER post_fts_update')
+        op.execute('DROP TRIGGER post_fts_delete')
+        op.execute('DROP TRIGGER post_fts_insert')
+        op.execute('DROP TABLE post_fts')
+    elif dialect == 'postgresql':
+        op.execute('DROP INDEX ix_post_fts')
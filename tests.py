@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 from datetime import datetime, timezone, timedelta
 import unittest
+import sqlalchemy as sa
 from app import create_app, db
-from app.models import User, Post
+from app.models import User, Post, timeline_entry
 from config import Config
 
 
@@ -48,6 +49,8 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(followers, [])
 
         u1.follow(u2)
+        self.assertEqual(u1.following_count(), 1)
+        self.assertEqual(u2.followers_count(), 1)
         db.session.commit()
         self.assertTrue(u1.is_following(u2))
         self.assertEqual(u1.following_count(), 1)
@@ -58,11 +61,44 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(u2_followers[0].username, 'john')
 
         u1.unfollow(u2)
+        self.assertEqual(u1.following_count(), 0)
+        self.assertEqual(u2.followers_count(), 0)
         db.session.commit()
         self.assertFalse(u1.is_following(u2))
         self.assertEqual(u1.following_count(), 0)
         self.assertEqual(u2.followers_count(), 0)
 
+    def test_counters(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        p1 = Post(body='post from john', author=u1)
+        p2 = Post(body='another post from john', author=u1)
+        db.session.add_all([p1, p2])
+        db.session.flush()
+        self.assertEqual(u1.posts_count(), 2)
+        db.session.commit()
+        self.assertEqual(u1.posts_count(), 2)
+        db.session.delete(p2)
+        db.session.flush()
+        self.assertEqual(u1.posts_count(), 1)
+        db.session.commit()
+        self.assertEqual(u1.posts_count(), 1)
+
+        # drift introduced behind the back of the model is repaired
+        u1.num_posts = 5
+        u2.num_followers = 3
+        db.session.commit()
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['counters', 'verify'])
+        self.assertIn('num_posts is 5, should be 1', result.output)
+        self.assertIn('num_followers is 3, should be 0', result.output)
+        self.assertEqual(u1.posts_count(), 1)
+        self.assertEqual(u2.followers_count(), 0)
+        result = runner.invoke(args=['counters', 'verify'])
+        self.assertIn('No counter drift found.', result.output)
+
     def test_follow_posts(self):
         # create four users
         u1 = User(username='john', email='john@example.com')
@@ -101,6 +137,75 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(f3, [p3, p4])
         self.assertEqual(f4, [p4])
 
+    def test_timeline_posts(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+
+        now = datetime.now(timezone.utc)
+        p1 = Post(body="post from susan", author=u2,
+                  timestamp=now + timedelta(seconds=1))
+        db.session.add(p1)
+        db.session.commit()
+
+        # following backfills the timeline with existing posts
+        u1.follow(u2)
+        u3.follow(u1)
+        db.session.commit()
+        self.assertEqual(db.session.scalars(u1.timeline_posts()).all(), [p1])
+
+        # new posts are fanned out to the followers of the author
+        p2 = Post(body="post from john", author=u1,
+                  timestamp=now + timedelta(seconds=2))
+        db.session.add(p2)
+        db.session.commit()
+        self.assertEqual(db.session.scalars(u1.timeline_posts()).all(),
+                         [p2, p1])
+        self.assertEqual(db.session.scalars(u3.timeline_posts()).all(), [p2])
+
+        # unfollowing trims the posts of the unfollowed user
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(db.session.scalars(u1.timeline_posts()).all(), [p2])
+
+        # rebuilding reproduces the join based home page query
+        u1.follow(u2)
+        db.session.commit()
+        u1.rebuild_timeline()
+        db.session.commit()
+        self.assertEqual(db.session.scalars(u1.timeline_posts()).all(),
+                         db.session.scalars(u1.following_posts()).all())
+
+    def test_timeline_length(self):
+        self.app.config['TIMELINE_LENGTH'] = 2
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        now = datetime.now(timezone.utc)
+        posts = [Post(body='post {}'.format(i), author=u2,
+                      timestamp=now + timedelta(seconds=i))
+                 for i in range(3)]
+        db.session.add_all(posts)
+        db.session.commit()
+
+        # the oldest entries are trimmed when following and on fan-out
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count()).where(
+            timeline_entry.c.user_id == u1.id)), 2)
+        p = Post(body='post 3', author=u2,
+                 timestamp=now + timedelta(seconds=3))
+        db.session.add(p)
+        db.session.commit()
+        for user in (u1, u2):
+            self.assertEqual(db.session.scalars(user.timeline_posts()).all(),
+                             [p, posts[2]])
+            self.assertEqual(db.session.scalar(
+                sa.select(sa.func.count()).where(
+                    timeline_entry.c.user_id == user.id)), 2)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
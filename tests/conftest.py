@@ -1,4 +1,8 @@
+from contextlib import contextmanager
+
 import pytest
+import redis
+import sqlalchemy as sa
 
 from app import create_app, db
 from app.models import User
@@ -9,6 +13,212 @@ class TestConfig(Config):
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
     WTF_CSRF_ENABLED = False
     TESTING = True
+    SEARCH_BACKEND = "memory"
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.channels = []
+        self.messages = []
+        self.closed = False
+
+    def subscribe(self, channel):
+        self.redis.check()
+        self.channels.append(channel)
+
+    def get_message(self, timeout=None):
+        self.redis.check()
+        return self.messages.pop(0) if self.messages else None
+
+    def close(self):
+        self.closed = True
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        self.redis.check()
+        commands, self.commands = self.commands, []
+        return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+class FakeRedis:
+    """In-memory stand-in for the Redis commands used by the application.
+
+    Expirations are recorded but not enforced, and setting ``down`` makes
+    every command fail as if the server could not be reached.
+    """
+
+    def __init__(self, down=False):
+        self.data = {}
+        self.expirations = {}
+        self.published = []
+        self.pubsubs = []
+        self.down = down
+
+    def check(self):
+        if self.down:
+            raise redis.exceptions.ConnectionError("Redis is down")
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def exists(self, *keys):
+        self.check()
+        return sum(key in self.data for key in keys)
+
+    def delete(self, *keys):
+        self.check()
+        for key in keys:
+            self.expirations.pop(key, None)
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def expire(self, key, seconds):
+        self.check()
+        if key not in self.data:
+            return False
+        self.expirations[key] = seconds
+        return True
+
+    def rename(self, src, dst):
+        self.check()
+        if src not in self.data:
+            raise redis.exceptions.ResponseError("no such key")
+        self.data[dst] = self.data.pop(src)
+        self.expirations.pop(dst, None)
+        if src in self.expirations:
+            self.expirations[dst] = self.expirations.pop(src)
+        return True
+
+    def get(self, key):
+        self.check()
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False, get=False):
+        self.check()
+        old = self.data.get(key)
+        if nx and old is not None:
+            return old if get else None
+        self.data[key] = _encode(value)
+        self.expirations.pop(key, None)
+        if ex is not None:
+            self.expirations[key] = ex
+        return old if get else True
+
+    def incr(self, key):
+        self.check()
+        value = int(self.data.get(key, 0)) + 1
+        self.data[key] = _encode(value)
+        return value
+
+    def append(self, key, value):
+        self.check()
+        self.data[key] = self.data.get(key, b"") + _encode(value)
+        return len(self.data[key])
+
+    def strlen(self, key):
+        self.check()
+        return len(self.data.get(key, b""))
+
+    def getrange(self, key, start, end):
+        self.check()
+        value = self.data.get(key, b"")
+        return value[start:] if end == -1 else value[start:end + 1]
+
+    def hincrby(self, key, field, amount=1):
+        self.check()
+        hash = self.data.setdefault(key, {})
+        hash[_encode(field)] = _encode(int(hash.get(_encode(field), 0)) +
+                                       amount)
+        return int(hash[_encode(field)])
+
+    def hgetall(self, key):
+        self.check()
+        return dict(self.data.get(key, {}))
+
+    def zadd(self, key, mapping):
+        self.check()
+        members = self.data.setdefault(key, {})
+        added = sum(_encode(member) not in members for member in mapping)
+        members.update((_encode(member), float(score))
+                       for member, score in mapping.items())
+        return added
+
+    def zrem(self, key, *members):
+        self.check()
+        zset = self.data.get(key, {})
+        return sum(zset.pop(_encode(member), None) is not None
+                   for member in members)
+
+    def zscore(self, key, member):
+        self.check()
+        return self.data.get(key, {}).get(_encode(member))
+
+    def zcard(self, key):
+        self.check()
+        return len(self.data.get(key, {}))
+
+    def zremrangebyscore(self, key, min, max):
+        self.check()
+        zset = self.data.get(key, {})
+        removed = [member for member, score in zset.items()
+                   if float(min) <= score <= float(max)]
+        for member in removed:
+            del zset[member]
+        return len(removed)
+
+    def zrangebylex(self, key, min, max, start=None, num=None):
+        self.check()
+
+        def within(member, bound, lower):
+            if bound in (b"-", b"+"):
+                return (bound == b"-") == lower
+            if lower:
+                return member >= bound[1:] if bound[:1] == b"[" \
+                    else member > bound[1:]
+            return member <= bound[1:] if bound[:1] == b"[" \
+                else member < bound[1:]
+
+        members = sorted(
+            member for member in self.data.get(key, {})
+            if within(member, _encode(min), True) and
+            within(member, _encode(max), False))
+        if start is not None:
+            members = members[start:start + num]
+        return members
+
+    def publish(self, channel, message):
+        self.check()
+        self.published.append((channel, message))
+        receivers = [pubsub for pubsub in self.pubsubs
+                     if channel in pubsub.channels and not pubsub.closed]
+        for pubsub in receivers:
+            pubsub.messages.append({"type": "message", "channel": channel,
+                                    "data": _encode(message)})
+        return len(receivers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        self.pubsubs.append(FakePubSub(self))
+        return self.pubsubs[-1]
 
 
 @pytest.fixture(scope="session")
@@ -23,8 +233,11 @@ def client(app):
     with app.app_context():
         db.create_all()
         yield app.test_client()
+        # keeps the flush timer from writing into a later test
+        app.last_seen.flush()
         db.session.remove()
         db.drop_all()
+        app.search.clear()
 
 
 @pytest.fixture
@@ -43,6 +256,38 @@ def auth_headers(user: User):
     return {"Authorization": f"Bearer {token}"}
 
 
+@pytest.fixture
+def fake_redis(app, monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(app, "redis", fake)
+    return fake
+
+
+@pytest.fixture
+def query_counter(app):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sa.event.listen(db.engine, "before_cursor_execute", count)
+    yield statements
+    sa.event.remove(db.engine, "before_cursor_execute", count)
+
+
+@pytest.fixture
+def query_budget(query_counter):
+    @contextmanager
+    def budget(limit):
+        query_counter.clear()
+        yield query_counter
+        assert len(query_counter) <= limit, \
+            "{} queries, the budget is {}:\n{}".format(
+                len(query_counter), limit, "\n".join(query_counter))
+
+    return budget
+
+
 def login_user_via_client(client, username, password):
     return client.post(
         "/auth/login",
@@ -1,8 +1,17 @@
 from base64 import b64encode
+from datetime import datetime, timezone
+import pytest
 from app import db
+from app.cache import TwoTierCache
 from app.models import User
 
 
+@pytest.fixture(autouse=True)
+def token_cache(app, fake_redis, monkeypatch):
+    monkeypatch.setattr(app, "token_cache",
+                        TwoTierCache(fake_redis, "tokens"))
+
+
 def test_post_tokens(client):
     user = User(username="u", email="u@example.com")
     user.set_password("testpass")
@@ -31,3 +40,80 @@ def test_delete_tokens(client, user, auth_headers):
 
     r3 = client.delete("/api/tokens", headers={"Authorization": "Bearer invalid-token"})
     assert r3.status_code == 401
+
+
+def test_token_cache(client, user, auth_headers, query_counter):
+    assert client.get(f"/api/users/{user.id}",
+                      headers=auth_headers).status_code == 200
+    query_counter.clear()
+    assert client.get(f"/api/users/{user.id}",
+                      headers=auth_headers).status_code == 200
+    assert not any("user.token = " in statement for statement in query_counter)
+
+    r = client.delete("/api/tokens", headers=auth_headers)
+    assert r.status_code == 204
+    r = client.get(f"/api/users/{user.id}", headers=auth_headers)
+    assert r.status_code == 401
+
+    token = user.get_token()
+    db.session.commit()
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/api/users", headers=headers).status_code == 200
+    user.token_expiration = datetime.now(timezone.utc)
+    assert user.get_token() != token
+    db.session.commit()
+    assert client.get("/api/users", headers=headers).status_code == 401
+
+
+def test_token_revocation_fails_closed(app, client, user, auth_headers,
+                                       fake_redis):
+    # another process reading the shared tier must see the revocation
+    other = TwoTierCache(fake_redis, "tokens", local_ttl=0)
+    assert client.get("/api/users", headers=auth_headers).status_code == 200
+    key = User.token_cache_key(user.token)
+    assert other.get(key)[0] == user.id
+
+    fake_redis.down = True
+    assert client.delete("/api/tokens",
+                         headers=auth_headers).status_code == 503
+    fake_redis.down = False
+    db.session.refresh(user)
+    assert user.token_expiration.replace(tzinfo=timezone.utc) > \
+        datetime.now(timezone.utc)
+    assert other.get(key)[1] > 0
+
+    assert client.delete("/api/tokens",
+                         headers=auth_headers).status_code == 204
+    assert other.get(key) == [user.id, 0]
+    assert client.get("/api/users", headers=auth_headers).status_code == 401
+
+    # a token validated from the database does not replace the revocation
+    app.token_cache.set(key, [user.id, 2 ** 31], overwrite=False)
+    assert other.get(key) == [user.id, 0]
+
+
+def test_jwt_tokens(app, client, user, query_counter, fake_redis,
+                    monkeypatch):
+    monkeypatch.setitem(app.config, "API_TOKEN_MODE", "jwt")
+    cred = b64encode(b"testuser:testpass").decode("utf-8")
+    token = client.post("/api/tokens", headers={
+        "Authorization": f"Basic {cred}"}).get_json()["token"]
+    assert user.token is None
+    headers = {"Authorization": f"Bearer {token}"}
+
+    query_counter.clear()
+    r = client.delete("/api/tokens", headers=headers)
+    assert r.status_code == 204
+    assert not any("user.token = " in statement for statement in query_counter)
+    assert client.get("/api/users", headers=headers).status_code == 401
+    assert fake_redis.zcard("tokens:revoked") == 1
+
+    reset_token = user.get_reset_password_token()
+    r = client.get("/api/users",
+                   headers={"Authorization": f"Bearer {reset_token}"})
+    assert r.status_code == 401
+
+    fake_redis.down = True
+    headers = {"Authorization": f"Bearer {user.get_token()}"}
+    assert client.get("/api/users", headers=headers).status_code == 401
+    assert client.delete("/api/tokens", headers=headers).status_code == 401
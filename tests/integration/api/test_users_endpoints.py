@@ -1,4 +1,6 @@
 import json
+import pytest
+import sqlalchemy as sa
 from app import db
 from app.models import User
 
@@ -91,3 +93,105 @@ def test_update_user(client, user, auth_headers):
         headers=auth_headers2,
     )
     assert r_403.status_code == 403
+
+
+def test_get_users_cursor_pagination(client, user, auth_headers):
+    for i in range(2):
+        u = User(username=f"cursor{i}", email=f"cursor{i}@example.com")
+        db.session.add(u)
+    db.session.commit()
+
+    r = client.get("/api/users?per_page=2&cursor=", headers=auth_headers)
+    assert r.status_code == 200
+    data = r.get_json()
+    assert [u["username"] for u in data["items"]] == ["testuser", "cursor0"]
+    assert "total_items" not in data["_meta"]
+    assert data["_links"]["prev"] is None
+
+    r2 = client.get(data["_links"]["next"], headers=auth_headers)
+    data2 = r2.get_json()
+    assert [u["username"] for u in data2["items"]] == ["cursor1"]
+    assert data2["_links"]["next"] is None
+
+    r3 = client.get(data2["_links"]["prev"], headers=auth_headers)
+    assert r3.get_json()["items"] == data["items"]
+
+
+def test_user_collections_query_count_is_fixed(
+        app, client, user, auth_headers, query_counter):
+    def count_queries(url):
+        query_counter.clear()
+        r = client.get(url, headers=auth_headers)
+        assert r.status_code == 200
+        return len(query_counter)
+
+    def add_users(names):
+        for name in names:
+            other = User(username=name, email=f"{name}@example.com")
+            db.session.add(other)
+            other.follow(user)
+            user.follow(other)
+        db.session.commit()
+
+    add_users(["a"])
+    client.get("/api/users", headers=auth_headers)  # caches the token
+    urls = ["/api/users", f"/api/users/{user.id}/followers",
+            f"/api/users/{user.id}/following"]
+    few = [count_queries(url) for url in urls]
+    add_users(["b", "c", "d", "e"])
+    many = [count_queries(url) for url in urls]
+    assert many == few
+
+    r = client.get(f"/api/users/{user.id}/followers", headers=auth_headers)
+    items = r.get_json()["items"]
+    assert len(items) == 5
+    with app.test_request_context():
+        assert items[0] == db.session.get(User, items[0]["id"]).to_dict()
+    assert items[0]["_links"]["following"] == \
+        f"/api/users/{items[0]['id']}/following"
+    assert items[0]["follower_count"] == 1
+
+
+def test_autocomplete_users(app, client, user, auth_headers, fake_redis):
+    for name in ["alice", "alfred", "bob"]:
+        db.session.add(User(username=name, email=f"{name}@example.com"))
+    db.session.commit()
+
+    r = client.get("/api/users/autocomplete?prefix=al", headers=auth_headers)
+    assert [u["username"] for u in r.get_json()["items"]] == \
+        ["alfred", "alice"]
+    r = client.get("/api/users/autocomplete", headers=auth_headers)
+    assert r.status_code == 400
+
+    result = app.test_cli_runner().invoke(args=["users",
+                                                "rebuild-autocomplete"])
+    assert "Indexed 4 usernames." in result.output
+    payload = {"username": "alan", "email": "alan@example.com",
+               "password": "P@ssw0rd"}
+    client.post("/api/users", data=json.dumps(payload),
+                content_type="application/json")
+    alice = db.session.scalar(sa.select(User).where(
+        User.username == "alice"))
+    alice.username = "carol"
+    db.session.commit()
+
+    r = client.get("/api/users/autocomplete?prefix=al&limit=5",
+                   headers=auth_headers)
+    assert [u["username"] for u in r.get_json()["items"]] == \
+        ["alan", "alfred"]
+    r = client.get("/api/users/autocomplete?prefix=c", headers=auth_headers)
+    assert r.get_json()["items"] == [{"id": alice.id, "username": "carol"}]
+
+
+@pytest.mark.parametrize("shared", [False, True])
+@pytest.mark.parametrize("limit", ["-1", "0"])
+def test_autocomplete_users_limit_lower_bound(app, client, user, auth_headers,
+                                              fake_redis, shared, limit):
+    for i in range(3):
+        db.session.add(User(username=f"al{i}", email=f"al{i}@example.com"))
+    db.session.commit()
+    if shared:
+        app.test_cli_runner().invoke(args=["users", "rebuild-autocomplete"])
+    r = client.get(f"/api/users/autocomplete?prefix=al&limit={limit}",
+                   headers=auth_headers)
+    assert [u["username"] for u in r.get_json()["items"]] == ["al0"]
@@ -0,0 +1,68 @@
+import pytest
+
+from app import db
+from app.models import Post, User
+from tests.conftest import login_user_via_client
+
+
+def add_authors(user, start, count):
+    for i in range(start, start + count):
+        author = User(username=f"author{i}", email=f"author{i}@example.com")
+        db.session.add(author)
+        db.session.add(Post(body=f"post {i}", author=author))
+        db.session.add(Post(body=f"own post {i}", author=user))
+        user.follow(author)
+    db.session.commit()
+
+
+def count_queries(app, client, query_counter, url):
+    app.last_seen.flush()
+    query_counter.clear()
+    assert client.get(url).status_code == 200
+    return len(query_counter)
+
+
+@pytest.mark.parametrize("url", ["/index", "/explore", "/user/testuser",
+                                 "/user/author0"])
+def test_listing_query_count_is_fixed(app, client, user, query_counter, url):
+    login_user_via_client(client, "testuser", "testpass")
+    add_authors(user, 0, 1)
+    few = count_queries(app, client, query_counter, url)
+
+    add_authors(user, 1, 4)
+    many = count_queries(app, client, query_counter, url)
+
+    assert many == few
+
+
+@pytest.mark.parametrize("url,budget", [
+    ("/index", 5), ("/explore", 5), ("/user/testuser", 7),
+    ("/user/author0", 7), ("/user/author0/popup", 3), ("/messages", 8),
+    ("/notifications", 2), ("/search?q=post", 6)])
+def test_route_query_budget(app, client, user, query_budget, url, budget):
+    login_user_via_client(client, "testuser", "testpass")
+    add_authors(user, 0, 3)
+    app.last_seen.flush()
+    with query_budget(budget):
+        assert client.get(url).status_code == 200
+
+
+def test_query_stats_headers_in_debug_mode(app, client, user, monkeypatch):
+    login_user_via_client(client, "testuser", "testpass")
+    app.last_seen.flush()
+    response = client.get("/user/testuser")
+    assert "X-DB-Query-Count" not in response.headers
+
+    monkeypatch.setitem(app.config, "DEBUG", True)
+    response = client.get("/user/testuser")
+    assert int(response.headers["X-DB-Query-Count"]) > 0
+    assert float(response.headers["X-DB-Query-Time"]) >= 0
+
+
+def test_slow_queries_are_logged(app, client, user, monkeypatch, caplog):
+    login_user_via_client(client, "testuser", "testpass")
+    monkeypatch.setitem(app.config, "SLOW_QUERY_THRESHOLD", 0)
+    with caplog.at_level("WARNING", logger=app.logger.name):
+        client.get("/user/testuser")
+    assert any("Slow query" in record.message and "main.user" in
+               record.message for record in caplog.records)
@@ -1,7 +1,15 @@
+from datetime import datetime, timedelta, timezone
+import json
+import re
+import time
+
+import pytest
 import sqlalchemy as sa
 
 from app import db
+from app.last_seen import LastSeenBuffer
 from app.models import Message, Post, User
+from app.pagination import encode_cursor
 from tests.conftest import login_user_via_client
 
 
@@ -13,6 +21,116 @@ def test_index_post(client, user):
     assert post.body == "hello"
 
 
+def test_explore_cursor_pagination(client, user):
+    now = datetime.now(timezone.utc)
+    for i in range(7):
+        db.session.add(Post(body=f"post {i}", author=user,
+                            timestamp=now + timedelta(seconds=i)))
+    db.session.commit()
+    login_user_via_client(client, "testuser", "testpass")
+
+    r = client.get("/explore")
+    html = r.get_data(as_text=True)
+    assert "post 6" in html and "post 2" in html and "post 1" not in html
+    next_url = re.search(r'href="(/explore\?cursor=[^"]+)"', html).group(1)
+
+    html2 = client.get(next_url).get_data(as_text=True)
+    assert "post 1" in html2 and "post 0" in html2 and "post 2" not in html2
+    prev_url = re.search(r'href="(/explore\?cursor=[^"]+)"', html2).group(1)
+
+    html3 = client.get(prev_url).get_data(as_text=True)
+    assert "post 6" in html3 and "post 2" in html3 and "post 1" not in html3
+
+
+@pytest.mark.parametrize("key", [
+    ["2020-01-01T00:00:00", {"a": 1}], ["2020-01-01T00:00:00", [1, 2]],
+    ["2020-01-01T00:00:00", "1"], ["2020-01-01T00:00:00", True],
+    [5, 1], ["x", 1]])
+def test_explore_tampered_cursor(client, user, key):
+    db.session.add(Post(body="post", author=user))
+    db.session.commit()
+    login_user_via_client(client, "testuser", "testpass")
+    r = client.get("/explore?cursor=" + encode_cursor(["next"] + key))
+    assert r.status_code == 200
+    assert "post" in r.get_data(as_text=True)
+
+
+def test_search(client, user):
+    db.session.add(Post(body="searching for foxes", author=user))
+    db.session.commit()
+    login_user_via_client(client, "testuser", "testpass")
+    assert "foxes" not in client.get("/search?q=dogs").get_data(as_text=True)
+
+    db.session.add(Post(body="foxes and dogs", author=user))
+    db.session.add(Post(body="nothing here", author=user))
+    db.session.commit()
+    html = client.get("/search?q=foxes").get_data(as_text=True)
+    assert "searching for foxes" in html and "foxes and dogs" in html
+    assert "nothing here" not in html
+
+
+def test_search_pagination(app, client, user, monkeypatch):
+    monkeypatch.setitem(app.config, "POSTS_PER_PAGE", 2)
+    for i in range(3):
+        db.session.add(Post(body=f"fox {i}", author=user))
+    db.session.commit()
+    login_user_via_client(client, "testuser", "testpass")
+
+    html = client.get("/search?q=fox").get_data(as_text=True)
+    assert html.count('class="user_popup"') == 2
+    next_url = re.search(r'href="(/search\?q=fox&amp;cursor=[^"]+)"',
+                         html).group(1).replace("&amp;", "&")
+    html2 = client.get(next_url).get_data(as_text=True)
+    assert html2.count('class="user_popup"') == 1
+
+
+def test_last_seen_is_written_behind(app, client, user):
+    last_seen = user.last_seen
+    login_user_via_client(client, "testuser", "testpass")
+    app.last_seen.last_flush = time.monotonic()
+    client.get("/explore")
+    db.session.expire_all()
+    assert db.session.get(User, user.id).last_seen == last_seen
+
+    app.last_seen.flush()
+    db.session.expire_all()
+    assert db.session.get(User, user.id).last_seen > last_seen
+
+
+def test_last_seen_flush_failure(app, client, user, monkeypatch, caplog):
+    login_user_via_client(client, "testuser", "testpass")
+    execute = db.session.execute
+
+    def failing_execute(statement, *args, **kwargs):
+        if isinstance(statement, sa.Update):
+            raise sa.exc.OperationalError(str(statement), {}, None)
+        return execute(statement, *args, **kwargs)
+
+    monkeypatch.setattr(db.session, "execute", failing_execute)
+    app.last_seen.last_flush = 0
+    with caplog.at_level("WARNING", logger=app.logger.name):
+        assert client.get("/explore").status_code == 200
+    assert user.id in app.last_seen.pending
+    assert "Could not write last_seen" in caplog.text
+
+    monkeypatch.undo()
+    app.last_seen.flush()
+    assert not app.last_seen.pending
+
+
+def test_last_seen_is_flushed_when_idle(app, client, user):
+    last_seen = user.last_seen
+    buffer = LastSeenBuffer(app, flush_interval=0.1)
+    buffer.record(user.id, datetime.now(timezone.utc))
+    timer = buffer.timer
+    assert timer is not None and user.id in buffer.pending
+    # no further requests arrive, the timer writes the pending timestamps
+    timer.join(5)
+    assert not buffer.pending and buffer.timer is None
+    db.session.expire_all()
+    assert db.session.get(User, user.id).last_seen > last_seen
+
+
 def test_edit_profile_get_and_post(client, user):
     login_user_via_client(client, "testuser", "testpass")
 
@@ -60,3 +178,67 @@ def test_send_message(client, user):
         )
     )
     assert message.body == "hi"
+
+
+def test_notifications_are_published_after_commit(client, user,
+                                                  fake_redis):
+    user.add_notification("unread_message_count", 1)
+    assert fake_redis.published == []
+    db.session.rollback()
+    db.session.commit()
+    assert fake_redis.published == []
+
+    user.add_notification("unread_message_count", 2)
+    db.session.commit()
+    published = [(channel, json.loads(message))
+                 for channel, message in fake_redis.published]
+    assert published[0][0] == f"notifications:{user.id}"
+    assert published[0][1]["data"] == 2
+
+    login_user_via_client(client, "testuser", "testpass")
+    r = client.get("/notifications")
+    assert r.get_json()[0]["timestamp"] == published[0][1]["timestamp"]
+
+
+def test_notifications_stream(client, user, fake_redis):
+    user.add_notification("unread_message_count", 1)
+    db.session.commit()
+    login_user_via_client(client, "testuser", "testpass")
+
+    r = client.get("/notifications/stream")
+    assert r.status_code == 200
+    assert r.mimetype == "text/event-stream"
+    assert r.headers["Cache-Control"] == "no-cache"
+    events = iter(r.response)
+    backlog = next(events).decode()
+    assert backlog.startswith("id: ")
+    assert json.loads(backlog.split("data: ")[1])["data"] == 1
+
+    fake_redis.publish(f"notifications:{user.id}", json.dumps(
+        {"name": "unread_message_count", "data": 2, "timestamp": 2.0}))
+    assert next(events).decode() == "id: 2.0\ndata: {}\n\n".format(
+        json.dumps({"name": "unread_message_count", "data": 2,
+                    "timestamp": 2.0}))
+    assert next(events).decode() == ": keepalive\n\n"
+    r.close()
+    assert fake_redis.pubsubs[0].closed
+
+
+@pytest.mark.parametrize("body", [
+    None, [1, 2], {}, {"items": "text"}, {"items": ["a"]},
+    {"items": [{"text": "hola"}]},
+    {"items": [{"text": 1, "source_language": "es",
+                "dest_language": "en"}]},
+    {"items": [{"text": "x" * 10001, "source_language": "es",
+                "dest_language": "en"}]},
+    {"items": [{"text": "hola", "source_language": "es",
+                "dest_language": "en"}] * 101}])
+def test_translate_batch_bad_request(client, user, body):
+    login_user_via_client(client, "testuser", "testpass")
+    if body is None:
+        r = client.post("/translate/batch", data="not json",
+                        content_type="text/plain")
+    else:
+        r = client.post("/translate/batch", json=body)
+    assert r.status_code == 400
+    assert r.get_json()["error"] == "Bad Request"
@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+import re
+
+import pytest
+import sqlalchemy as sa
+
+from app import db
+from app.models import Message, Post, User
+from app.pagination import encode_cursor
+from tests.conftest import login_user_via_client
+
+# a table scan without an index, or a sort that could not use one
+BAD_PLAN = re.compile(r"^SCAN \w+$|USE TEMP B-TREE")
+
+
+def query_plan(statement, parameters=()):
+    with db.engine.connect() as conn:
+        return [row[3] for row in conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + statement, parameters)]
+
+
+def compiled(query):
+    compiled = query.compile(db.engine)
+    return str(compiled), compiled.positiontup and tuple(
+        compiled.params[name] for name in compiled.positiontup)
+
+
+@pytest.fixture
+def statements(app):
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT") and not executemany:
+            executed.append((statement, parameters))
+
+    sa.event.listen(db.engine, "before_cursor_execute", record)
+    yield executed
+    sa.event.remove(db.engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def author(user):
+    author = User(username="author", email="author@example.com")
+    db.session.add(author)
+    user.follow(author)
+    db.session.add_all([Post(body="mine", author=user),
+                        Post(body="theirs", author=author),
+                        Message(body="hi", author=author, recipient=user)])
+    user.add_notification("unread_message_count", 1)
+    db.session.commit()
+    return author
+
+
+@pytest.mark.parametrize("url", ["/user/testuser", "/user/author",
+                                 "/user/testuser?cursor={cursor}",
+                                 "/messages", "/messages?cursor={cursor}",
+                                 "/notifications"])
+def test_route_query_plans(app, client, user, author, statements, url):
+    cursor = encode_cursor(["next", datetime.now(timezone.utc), 2 ** 31])
+    login_user_via_client(client, "testuser", "testpass")
+    app.last_seen.flush()
+    statements.clear()
+    assert client.get(url.format(cursor=cursor)).status_code == 200
+    assert statements
+    for statement, parameters in statements:
+        plan = query_plan(statement, parameters)
+        assert not any(BAD_PLAN.search(step) for step in plan), \
+            (statement, plan)
+
+
+def test_unread_message_count_query_plan(client, user, author, statements):
+    assert user.unread_message_count() == 1
+    for statement, parameters in statements:
+        plan = query_plan(statement, parameters)
+        assert not any(BAD_PLAN.search(step) for step in plan), \
+            (statement, plan)
+
+
+def test_following_posts_query_plan(client, user, author):
+    plan = query_plan(*compiled(user.following_posts()))
+    # merging the posts of several authors needs a sort, but no grouping
+    # and no scans of the whole post table
+    assert not any(BAD_PLAN.search(step) for step in plan
+                   if step != "USE TEMP B-TREE FOR ORDER BY"), plan
+    assert "USE TEMP B-TREE FOR GROUP BY" not in plan
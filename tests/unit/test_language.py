@@ -0,0 +1,55 @@
+import uuid
+
+import sqlalchemy as sa
+
+from app import db
+from app.cache import TwoTierCache
+from app.language import LanguageDetector
+from app.models import Post
+from tests.conftest import login_user_via_client
+
+
+def test_detect_is_cached_and_deterministic(app):
+    detector = LanguageDetector(
+        TwoTierCache(app.redis, f"language-{uuid.uuid4().hex}"), seed=0)
+    text = "Ceci est une phrase écrite en français."
+    assert detector.detect(text) == "fr"
+    assert detector.detect(text) == "fr"
+    assert detector.cache.stats()["local_hits"] == 1
+    assert detector.detect("12345 !!!") == ""
+
+    other = LanguageDetector(
+        TwoTierCache(app.redis, f"language-{uuid.uuid4().hex}"), seed=0)
+    assert other.factory is detector.factory
+
+
+def test_detect_languages_command(app, client, user):
+    db.session.add_all([
+        Post(body="This post is written in English.", author=user),
+        Post(body="Este mensaje está escrito en español.", author=user,
+             language=""),
+        Post(body="Questo messaggio è scritto in italiano.", author=user,
+             language="xx"),
+    ])
+    db.session.commit()
+    result = app.test_cli_runner().invoke(
+        args=["posts", "detect-languages", "--batch-size", "1"])
+    assert "Processed 2 posts." in result.output
+    assert db.session.scalars(sa.select(Post.language).order_by(
+        Post.id)).all() == ["en", "es", "xx"]
+
+
+def test_language_detection_can_be_deferred(app, client, user, monkeypatch):
+    enqueued = []
+
+    class FakeQueue:
+        def enqueue(self, name, *args):
+            enqueued.append((name, args))
+
+    monkeypatch.setitem(app.config, "LANGUAGE_DETECTION_ASYNC", True)
+    monkeypatch.setattr(app, "task_queue", FakeQueue())
+    login_user_via_client(client, "testuser", "testpass")
+    client.post("/index", data={"post": "This post is written in English."})
+    post = db.session.scalar(sa.select(Post))
+    assert post.language is None
+    assert enqueued == [("app.tasks.detect_languages", ([post.id],))]
@@ -0,0 +1,49 @@
+import time
+
+from werkzeug.security import generate_password_hash
+
+from app import db, passwords
+from app.passwords import PasswordHasher
+
+
+def test_verify_caches_successful_checks(monkeypatch):
+    checks = []
+
+    def check_password_hash(password_hash, password):
+        checks.append(password)
+        return password == "right"
+
+    monkeypatch.setattr(passwords, "check_password_hash", check_password_hash)
+    hasher = PasswordHasher("secret", "pbkdf2:sha256:1000", cache_ttl=60)
+    password_hash = hasher.hash("right")
+    assert hasher.verify("susan", password_hash, "right")
+    assert hasher.verify("susan", password_hash, "right")
+    assert not hasher.verify("susan", password_hash, "wrong")
+    assert not hasher.verify("susan", password_hash, "wrong")
+    assert hasher.verify("susan", hasher.hash("right"), "right")
+    assert checks == ["right", "wrong", "wrong", "right"]
+
+
+def test_verify_times_out(app, monkeypatch):
+    def check_password_hash(password_hash, password):
+        time.sleep(0.2)
+        return True
+
+    monkeypatch.setattr(passwords, "check_password_hash", check_password_hash)
+    hasher = PasswordHasher("secret", "pbkdf2:sha256:1000", workers=1,
+                            timeout=0.05)
+    assert not hasher.verify("susan", hasher.hash("cat"), "cat")
+
+
+def test_password_is_rehashed_on_login(app, client, user, monkeypatch):
+    monkeypatch.setattr(app, "passwords",
+                        PasswordHasher("secret", "pbkdf2:sha256:1000"))
+    assert app.passwords.method == "pbkdf2:sha256:1000"
+    user.password_hash = generate_password_hash("testpass",
+                                                "pbkdf2:sha256:2000")
+    db.session.commit()
+    assert not user.check_password("wrong")
+    assert user.password_hash.startswith("pbkdf2:sha256:2000$")
+    assert user.check_password("testpass")
+    assert user.password_hash.startswith("pbkdf2:sha256:1000$")
+    assert user.check_password("testpass")
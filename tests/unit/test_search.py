@@ -0,0 +1,435 @@
+from elasticsearch import NotFoundError
+import pytest
+import sqlalchemy as sa
+
+from app import db, models, search
+from app.cache import TwoTierCache
+from app.models import Post, SearchOutbox
+from app.pagination import encode_cursor
+
+
+class RecordingBackend(search.SearchBackend):
+    uses_outbox = True
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.calls = []
+
+    def query(self, model, expression, page, per_page):
+        return [], 0
+
+    def update(self, model, objs, deleted_ids):
+        self.calls.append((model.__tablename__, [obj.body for obj in objs],
+                           deleted_ids))
+        return [obj.id for obj in objs if obj.body == "fail"]
+
+
+def test_search_outbox(app, client, user, monkeypatch):
+    scheduled = []
+    backend = RecordingBackend(app)
+    calls = backend.calls
+
+    monkeypatch.setattr(app, "search", backend)
+    monkeypatch.setattr(SearchOutbox, "schedule", staticmethod(
+        lambda delay=None: scheduled.append(delay)))
+
+    p1 = Post(body="one", author=user)
+    p2 = Post(body="two", author=user)
+    db.session.add_all([p1, p2])
+    db.session.commit()
+    p1.body = "uno"
+    db.session.commit()
+    db.session.delete(p2)
+    db.session.commit()
+
+    p3 = Post(body="three", author=user)
+    db.session.add(p3)
+    db.session.rollback()
+
+    entries = db.session.scalars(
+        sa.select(SearchOutbox).order_by(SearchOutbox.id)).all()
+    assert [(e.object_id, e.operation) for e in entries] == [
+        (p1.id, "index"), (p2.id, "index"), (p1.id, "index"),
+        (p2.id, "delete")]
+    assert len(scheduled) == 3
+
+    assert SearchOutbox.process() == 4
+    assert calls == [("post", ["uno"], [p2.id])]
+    assert db.session.scalar(
+        sa.select(sa.func.count()).select_from(SearchOutbox)) == 0
+
+    p1.body = "fail"
+    db.session.commit()
+    SearchOutbox.process()
+    entry = db.session.scalar(sa.select(SearchOutbox))
+    assert entry.object_id == p1.id and entry.attempts == 1
+    # failed entries are retried by a delayed drain that backs off
+    assert scheduled[-1] == 30
+    SearchOutbox.process()
+    assert scheduled[-1] == 60 and entry.attempts == 2
+
+    monkeypatch.setitem(app.config, "SEARCH_OUTBOX_MAX_ATTEMPTS", 3)
+    del scheduled[:]
+    SearchOutbox.process()
+    assert entry.attempts == 3 and scheduled == []
+
+
+def test_search_outbox_schedule(app, client, fake_redis, monkeypatch):
+    jobs = []
+
+    class FakeQueue:
+        def enqueue(self, func, retry=None):
+            jobs.append((func, None))
+
+        def enqueue_in(self, delay, func):
+            jobs.append((func, delay.total_seconds()))
+
+    monkeypatch.setattr(app, "task_queue", FakeQueue())
+    SearchOutbox.schedule()
+    SearchOutbox.schedule()
+    SearchOutbox.schedule(delay=30)
+    SearchOutbox.schedule(delay=30)
+    assert jobs == [("app.tasks.process_search_outbox", None),
+                    ("app.tasks.process_search_outbox", 30)]
+
+    # once a drain starts, later commits schedule another one
+    SearchOutbox.process()
+    SearchOutbox.schedule()
+    assert len(jobs) == 3
+    fake_redis.down = True
+    SearchOutbox.schedule()
+    assert len(jobs) == 3
+
+
+class FakeIndices:
+    def __init__(self):
+        self.created = []
+        self.aliases = {"post": ["post-old"]}
+        self.deleted = []
+
+    def create(self, index):
+        self.created.append(index)
+
+    def refresh(self, index):
+        pass
+
+    def exists_alias(self, name):
+        return name in self.aliases
+
+    def get_alias(self, name):
+        return {index: {} for index in self.aliases[name]}
+
+    def exists(self, index):
+        return False
+
+    def update_aliases(self, actions):
+        self.aliases["post"] = [action["add"]["index"] for action in actions
+                                if "add" in action]
+
+    def delete(self, index, ignore_unavailable=False):
+        self.deleted.append(index)
+
+
+class FakeElasticsearch:
+    def __init__(self):
+        self.indices = FakeIndices()
+
+
+def test_reindex(app, user, fake_redis, monkeypatch):
+    es = FakeElasticsearch()
+    indexed = []
+    fail_after = []
+
+    def bulk(client, actions, raise_on_error=True):
+        if fail_after and len(indexed) >= fail_after[0]:
+            raise RuntimeError("bulk request failed")
+        indexed.extend((action["_index"], action["_id"])
+                       for action in actions)
+        return len(actions), []
+
+    monkeypatch.setattr(app, "elasticsearch", es)
+    monkeypatch.setattr(app, "search", search.ElasticsearchBackend(app))
+    monkeypatch.setattr(search, "bulk", bulk)
+    posts = [Post(body=f"post {i}", author=user) for i in range(7)]
+    db.session.add_all(posts)
+    db.session.commit()
+    db.session.execute(sa.delete(SearchOutbox))
+    db.session.commit()
+
+    fail_after.append(4)
+    with pytest.raises(RuntimeError):
+        Post.reindex(workers=1, batch_size=2)
+    fail_after.clear()
+    unfinished = es.indices.created[0]
+    assert search.rebuild_status("post") == (False, unfinished)
+    assert es.indices.aliases["post"] == ["post-old"]
+
+    # after a failed rebuild, changes reach the live index and the index
+    # of the unfinished rebuild
+    p = Post(body="changed after the failure", author=user)
+    db.session.add(p)
+    db.session.commit()
+    assert SearchOutbox.process() == 1
+    assert ("post", p.id) in indexed and (unfinished, p.id) in indexed
+
+    # a running rebuild pauses the outbox and cannot be started twice
+    fake_redis.set("search:reindex:post:running", 1)
+    with pytest.raises(search.RebuildInProgress):
+        Post.reindex(resume=True)
+    q = Post(body="changed during reindex", author=user)
+    db.session.add(q)
+    db.session.commit()
+    assert SearchOutbox.process() == 0
+    assert db.session.scalar(
+        sa.select(sa.func.count()).select_from(SearchOutbox)) == 1
+    fake_redis.delete("search:reindex:post:running")
+
+    progress = []
+    index = Post.reindex(workers=2, batch_size=2, resume=True,
+                         progress=lambda done, total: progress.append(
+                             (done, total)))
+    assert index == unfinished
+    assert {id for name, id in indexed if name == index} == \
+        {post.id for post in posts + [p, q]}
+    assert progress[-1] == (5, 5)
+    assert es.indices.aliases["post"] == [index]
+    assert es.indices.deleted == ["post-old"]
+    assert search.rebuild_status("post") == (False, None)
+    assert fake_redis.expirations == {}
+
+
+def test_reindex_restart_drops_unfinished_index(app, user, fake_redis,
+                                                monkeypatch):
+    es = FakeElasticsearch()
+
+    def bulk(client, actions, raise_on_error=True):
+        raise RuntimeError("bulk request failed")
+
+    monkeypatch.setattr(app, "elasticsearch", es)
+    monkeypatch.setattr(search, "bulk", bulk)
+    db.session.add(Post(body="post", author=user))
+    db.session.commit()
+    with pytest.raises(RuntimeError):
+        Post.reindex()
+    unfinished = es.indices.created[0]
+
+    monkeypatch.setattr(search, "bulk", lambda client, actions: None)
+    index = Post.reindex()
+    assert es.indices.deleted == [unfinished, "post-old"]
+    assert es.indices.aliases["post"] == [index]
+
+
+def test_database_search(app, client, user, monkeypatch):
+    monkeypatch.setattr(app, "search", search.DatabaseBackend(app))
+    db.session.add_all([
+        Post(body="the quick brown fox", author=user),
+        Post(body="a lazy dog", author=user),
+        Post(body="quick quick dog", author=user),
+    ])
+    db.session.commit()
+    posts, total = Post.search("quick", 1, 10)
+    assert total == 2
+    assert [post.body for post in posts] == ["quick quick dog",
+                                             "the quick brown fox"]
+    posts, total = Post.search('dog "OR', 1, 1)
+    assert total == 2 and len(posts.all()) == 1
+
+    post = db.session.scalar(sa.select(Post).where(Post.body == "a lazy dog"))
+    post.body = "a lazy cat"
+    db.session.commit()
+    db.session.delete(db.session.scalar(
+        sa.select(Post).where(Post.body == "quick quick dog")))
+    db.session.commit()
+    assert Post.search("dog", 1, 10) == ([], 0)
+    assert [post.body for post in Post.search("cat", 1, 10)[0]] == \
+        ["a lazy cat"]
+
+
+def test_inverted_index():
+    index = search.InvertedIndex()
+    index.add(3, "the quick brown fox")
+    index.add(1, "quick quick dog")
+    index.add(2, "a lazy dog")
+    assert index.search(["quick"], 0, 10) == ([1, 3], 2)
+    assert index.search(["dog", "fox"], 0, 2) == ([3, 2], 3)
+    assert index.search(["dog", "fox"], 2, 2) == ([1], 3)
+
+    index.add(1, "a sleepy cat")
+    index.remove(3)
+    assert index.search(["quick"], 0, 10) == ([], 0)
+    assert list(index.postings["dog"][0]) == [2]
+    assert list(index.postings["a"][0]) == [1, 2]
+
+
+class StoredHitsBackend(search.SearchBackend):
+    uses_outbox = True
+
+    def __init__(self, app, hits):
+        super().__init__(app)
+        self.hits = hits
+
+    def query(self, model, expression, page, per_page):
+        return [id for id, source in self.hits], len(self.hits)
+
+    def query_hits(self, model, expression, page, per_page):
+        return self.hits, len(self.hits)
+
+
+def test_search_results_from_index(app, client, user, query_counter,
+                                   monkeypatch):
+    monkeypatch.setattr(SearchOutbox, "schedule", staticmethod(lambda: None))
+    p1 = Post(body="indexed", author=user)
+    p2 = Post(body="stale", author=user)
+    db.session.add_all([p1, p2])
+    db.session.commit()
+    monkeypatch.setattr(app, "search", StoredHitsBackend(app, [
+        (p1.id, search.document(p1, stored=True)),
+        (p2.id, {"body": "stale"}),
+        (p2.id + 1, None),
+    ]))
+    db.session.expire_all()
+    query_counter.clear()
+    posts, total = Post.search("anything", 1, 10, from_index=True)
+    assert len(query_counter) == 2
+    assert total == 3
+    assert [post.body for post in posts] == ["indexed", "stale"]
+    assert isinstance(posts[0], models.SearchHit)
+    assert posts[0].author.username == "testuser"
+    assert posts[0].author.avatar(36) == user.avatar(36)
+    assert posts[0].timestamp == p1.timestamp
+    assert isinstance(posts[1], Post)
+
+    user.username = "renamed"
+    db.session.commit()
+    assert sorted(db.session.scalars(sa.select(SearchOutbox.object_id).where(
+        SearchOutbox.operation == "index"))) == [p1.id, p2.id]
+
+
+def test_search_cache(app, client, user, fake_redis, monkeypatch):
+    monkeypatch.setattr(app, "search_cache",
+                        TwoTierCache(app.redis, "search-test", ttl=60))
+    queries = []
+    query_hits = app.search.query_hits
+
+    def counting_query_hits(model, expression, page, per_page):
+        queries.append(expression)
+        return query_hits(model, expression, page, per_page)
+
+    monkeypatch.setattr(app.search, "query_hits", counting_query_hits)
+    db.session.add(Post(body="hello world", author=user))
+    db.session.commit()
+    assert Post.search("Hello  World", 1, 10)[1] == 1
+    assert Post.search("hello world", 1, 10)[1] == 1
+    assert Post.search("hello world", 2, 10)[1] == 1
+    assert queries == ["Hello  World", "hello world"]
+
+    db.session.add(Post(body="hello again", author=user))
+    db.session.commit()
+    assert Post.search("hello world", 1, 10)[1] == 2
+    assert len(queries) == 3
+    assert app.search_cache.stats()["local_hits"] == 1
+
+
+class FakePitElasticsearch:
+    def __init__(self, scores):
+        self.scores = scores
+        self.pits = []
+        self.closed = []
+
+    def open_point_in_time(self, index, keep_alive):
+        self.pits.append(f"pit{len(self.pits)}")
+        return {"id": self.pits[-1]}
+
+    def close_point_in_time(self, id):
+        if id in self.closed:
+            raise NotFoundError("search_context_missing_exception",
+                                meta=None, body={})
+        self.closed.append(id)
+
+    def search(self, query, size, index=None, pit=None, sort=None,
+               search_after=None, from_=0):
+        if pit is not None and (pit["id"] != self.pits[-1] or
+                                pit["id"] in self.closed):
+            raise NotFoundError("search_context_missing_exception",
+                                meta=None, body={})
+        # ids stand in for the index order, which breaks ties in score
+        sort = sort or [{"_score": "desc"}, {"_shard_doc": "asc"}]
+        signs = [1 if next(iter(field.values())) == "asc" else -1
+                 for field in sort]
+
+        def key(hit):
+            return [sign * value for sign, value in zip(signs, hit)]
+
+        hits = sorted(([score, id] for id, score in self.scores.items()),
+                      key=key)
+        if search_after is not None:
+            hits = [hit for hit in hits if key(hit) > key(search_after)]
+        return {"pit_id": pit and pit["id"],
+                "hits": {"total": {"value": len(self.scores)}, "hits": [
+                    {"_id": str(id), "_source": {}, "sort": [score, id]}
+                    for score, id in hits[from_:from_ + size]]}}
+
+
+def test_elasticsearch_search_after(app, monkeypatch):
+    es = FakePitElasticsearch({1: 0.5, 2: 0.9, 3: 0.7, 4: 0.7, 5: 0.1})
+    monkeypatch.setattr(app, "elasticsearch", es)
+    backend = search.ElasticsearchBackend(app)
+
+    def ids(page):
+        return [id for id, source in page.items]
+
+    # the first page does not open a point in time
+    page1, total = backend.query_page(Post, "q", None, 2)
+    assert ids(page1) == [2, 3] and total == 5 and not page1.has_prev
+    assert es.pits == []
+    page2, total = backend.query_page(Post, "q", page1.next_cursor, 2)
+    assert ids(page2) == [4, 1] and page2.has_prev
+    assert es.pits == ["pit0"]
+
+    # an expired point in time is replaced, and closed at the last page
+    es.open_point_in_time("post", "1m")
+    page3, total = backend.query_page(Post, "q", page2.next_cursor, 2)
+    assert ids(page3) == [5] and not page3.has_next
+    assert es.pits == ["pit0", "pit1", "pit2"] and es.closed == ["pit2"]
+    assert ids(backend.query_page(Post, "q", page3.prev_cursor, 2)[0]) == \
+        [4, 1]
+    first, total = backend.query_page(Post, "q", page2.prev_cursor, 2)
+    assert ids(first) == [2, 3] and not first.has_prev
+    assert es.closed == ["pit2", "pit4"]
+
+
+def test_elasticsearch_equal_scores(app, monkeypatch):
+    es = FakePitElasticsearch(dict.fromkeys(range(1, 8), 0.5))
+    monkeypatch.setattr(app, "elasticsearch", es)
+    backend = search.ElasticsearchBackend(app)
+    pages = [backend.query_page(Post, "q", None, 2)[0]]
+    while pages[-1].has_next:
+        pages.append(backend.query_page(Post, "q", pages[-1].next_cursor,
+                                        2)[0])
+    assert [[id for id, source in page.items] for page in pages] == \
+        [[1, 2], [3, 4], [5, 6], [7]]
+    for page, previous in zip(pages[1:], pages):
+        assert backend.query_page(Post, "q", page.prev_cursor, 2)[0] \
+            .items == previous.items
+
+
+@pytest.mark.parametrize("data", [
+    ["next", "pit0", [{"a": 1}, 1]], ["next", "pit0", [0.5, [1]]],
+    ["next", "pit0", [True, 1]], ["next", 5, [0.5, 1]],
+    ["next", "pit0", "0.5"], ["from", 0], ["from", "2"], ["page", 2]])
+def test_elasticsearch_tampered_cursor(app, monkeypatch, data):
+    es = FakePitElasticsearch({1: 0.5, 2: 0.9, 3: 0.7})
+    monkeypatch.setattr(app, "elasticsearch", es)
+    backend = search.ElasticsearchBackend(app)
+    page, total = backend.query_page(Post, "q", encode_cursor(data), 2)
+    assert [id for id, source in page.items] == [2, 3]
+    assert es.pits == []
+
+
+def test_elasticsearch_single_page_needs_no_point_in_time(app, monkeypatch):
+    es = FakePitElasticsearch({1: 0.5, 2: 0.9})
+    monkeypatch.setattr(app, "elasticsearch", es)
+    page, total = search.ElasticsearchBackend(app).query_page(
+        Post, "q", None, 2)
+    assert len(page.items) == 2 and not page.has_next
+    assert es.pits == []
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta, timezone
+import gzip
+import json
+
+import pytest
+import sqlalchemy as sa
+
+from app import db, exports, mail
+from app.models import Post, User
+from config import Config
+from tests.conftest import login_user_via_client
+
+
+# the worker module creates its own app on import, keep that app from
+# setting up file logging
+with pytest.MonkeyPatch.context() as mp:
+    mp.setattr(Config, "TESTING", True, raising=False)
+    from app import tasks
+
+
+@pytest.fixture
+def export_app(app, fake_redis, monkeypatch):
+    monkeypatch.setitem(tasks.app.config, "EXPORT_POSTS_CHUNK_SIZE", 2)
+    monkeypatch.setattr(tasks.app, "redis", fake_redis)
+    monkeypatch.setattr(exports, "CHUNK_SIZE", 16)
+    return app
+
+
+def download(client):
+    login_user_via_client(client, "testuser", "testpass")
+    return client.get("/export_posts/download")
+
+
+def add_posts(user, count):
+    now = datetime.now(timezone.utc)
+    for i in range(count):
+        db.session.add(Post(body=f"post {i}", author=user,
+                            timestamp=now + timedelta(seconds=i)))
+    db.session.commit()
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_export_posts(export_app, client, user, fake_redis, monkeypatch,
+                      compressed):
+    monkeypatch.setitem(export_app.config, "EXPORT_POSTS_GZIP", compressed)
+    add_posts(user, 5)
+    with mail.record_messages() as outbox:
+        tasks.export_posts(user.id, "http://localhost/export_posts/download")
+    assert len(outbox) == 1
+    assert not outbox[0].attachments
+    assert "http://localhost/export_posts/download" in outbox[0].body
+
+    r = download(client)
+    assert r.status_code == 200
+    filename = "posts.json" + (".gz" if compressed else "")
+    assert r.headers["Content-Disposition"] == \
+        f"attachment; filename={filename}"
+    data = r.get_data()
+    assert int(r.headers["Content-Length"]) == len(data)
+    if compressed:
+        assert r.mimetype == "application/gzip"
+        data = gzip.decompress(data)
+    else:
+        assert r.mimetype == "application/json"
+    assert [post["body"] for post in json.loads(data)["posts"]] == \
+        [f"post {i}" for i in range(5)]
+    # finished exports are removed by Redis when they expire
+    assert set(fake_redis.expirations.values()) == \
+        {export_app.config["EXPORT_POSTS_TTL"]}
+
+
+def test_export_posts_replaces_previous_export(export_app, client, user,
+                                               fake_redis):
+    add_posts(user, 1)
+    tasks.export_posts(user.id, "http://localhost/export_posts/download")
+    first = json.loads(fake_redis.get(f"exports:posts:{user.id}"))["key"]
+    add_posts(user, 1)
+    tasks.export_posts(user.id, "http://localhost/export_posts/download")
+    assert fake_redis.expirations[first] == exports.REPLACED_EXPORT_TTL
+    assert len(json.loads(download(client).get_data())["posts"]) == 2
+
+
+def test_download_export_requires_an_export(export_app, client, user,
+                                            fake_redis):
+    assert download(client).status_code == 404
+    fake_redis.down = True
+    assert download(client).status_code == 503
+
+
+@pytest.fixture
+def reported(monkeypatch):
+    reported = []
+    monkeypatch.setattr(tasks, "_set_task_progress", reported.append)
+    return reported
+
+
+def test_progress_reporter_merges_updates(reported):
+    progress = tasks.ProgressReporter(step=10, interval=3600)
+    for i in range(101):
+        progress.update(i)
+    assert reported == [0, 10, 20, 30, 40, 50, 60, 70, 80, 90]
+    progress.finish()
+    progress.finish()
+    progress.update(50)
+    assert reported[-1] == 100 and reported.count(100) == 1
+
+
+def test_progress_reporter_interval(reported):
+    progress = tasks.ProgressReporter(step=10, interval=0)
+    for i in (0, 1, 1, 2, 150):
+        progress.update(i)
+    assert reported == [0, 1, 2, 99]
+
+
+def test_export_posts_with_stale_posts_count(export_app, client, user,
+                                             reported, caplog):
+    add_posts(user, 3)
+    db.session.execute(sa.update(User).where(User.id == user.id).values(
+        num_posts=0))
+    db.session.commit()
+    with caplog.at_level("ERROR"), mail.record_messages() as outbox:
+        tasks.export_posts(user.id, "http://localhost/export_posts/download")
+    assert "Unhandled exception" not in caplog.text
+    assert len(outbox) == 1
+    assert reported == [0, 100]
+    assert len(json.loads(download(client).get_data())["posts"]) == 3
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+from flask import Flask, request
+from werkzeug.serving import make_server
+
+from app.cache import TwoTierCache
+from app.translate import translate, translate_batch
+from tests.conftest import FakeRedis
+
+
+@pytest.fixture
+def translator():
+    fake = Flask("fake_translator")
+    fake.calls = []
+
+    @fake.route("/translate", methods=["POST"])
+    def fake_translate():
+        fake.calls.append((request.args["from"], request.args["to"],
+                           request.get_json()))
+        return [{"translations": [{"text": item["Text"].upper()}]}
+                for item in request.get_json()]
+
+    server = make_server("127.0.0.1", 0, fake)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    fake.url = f"http://127.0.0.1:{server.server_port}"
+    yield fake
+    server.shutdown()
+    thread.join(timeout=2)
+
+
+@pytest.fixture
+def translation_app(app, translator, monkeypatch):
+    monkeypatch.setitem(app.config, "MS_TRANSLATOR_KEY", "test-key")
+    monkeypatch.setitem(app.config, "MS_TRANSLATOR_URL", translator.url)
+    monkeypatch.setattr(app, "translation_cache", TwoTierCache(
+        FakeRedis(down=True), "translate", maxsize=2, ttl=60))
+    return app
+
+
+def test_translate_is_cached(translation_app, translator):
+    with translation_app.test_request_context():
+        assert translate("hola", "es", "en") == "HOLA"
+        assert translate("hola", "es", "en") == "HOLA"
+        assert translate("hola", "es", "fr") == "HOLA"
+    assert len(translator.calls) == 2
+    stats = translation_app.translation_cache.stats()
+    assert stats["local_hits"] == 1 and stats["misses"] == 2
+
+
+def test_translate_cache_evicts_least_recently_used(translation_app,
+                                                    translator):
+    with translation_app.test_request_context():
+        translate("uno", "es", "en")
+        translate("dos", "es", "en")
+        translate("uno", "es", "en")
+        translate("tres", "es", "en")
+        translate("uno", "es", "en")
+        translate("dos", "es", "en")
+    assert [call[2][0]["Text"] for call in translator.calls] == \
+        ["uno", "dos", "tres", "dos"]
+
+
+def test_translate_batch_groups_requests(translation_app, translator):
+    def item(text, source, dest):
+        return {"text": text, "source_language": source,
+                "dest_language": dest}
+
+    with translation_app.test_request_context():
+        translate("uno", "es", "en")
+        translations = translate_batch([
+            item("uno", "es", "en"), item("dos", "es", "en"),
+            item("un", "fr", "en"), item("dos", "es", "en"),
+            item("tres", "es", "en")])
+    assert translations == ["UNO", "DOS", "UN", "DOS", "TRES"]
+    assert [(call[0], [t["Text"] for t in call[2]])
+            for call in translator.calls] == [
+        ("es", ["uno"]), ("es", ["dos", "tres"]), ("fr", ["un"])]
+
+
+def test_translate_batch_upstream_failure(translation_app, monkeypatch):
+    monkeypatch.setitem(translation_app.config, "MS_TRANSLATOR_URL",
+                        "http://127.0.0.1:1")
+    with translation_app.test_request_context():
+        assert translate("hola", "es", "en") == \
+            "Error: the translation service failed."